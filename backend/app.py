@@ -1,47 +1,975 @@
 import asyncio
+import functools
+import hashlib
 import io
+import ipaddress
+import math
 import os
+import random
+import re
+import socket
+import sqlite3
+import threading
+import time
+import heapq
+import importlib
 import traceback
+import collections
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Callable, Awaitable, Tuple, AsyncIterator, Union, TYPE_CHECKING
 
-import requests
-from PIL import Image, ImageDraw, ImageFont
+import httpx
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, features
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
-from openai import AzureOpenAI
-from pydantic import BaseModel, Field
-from google import genai
-from google.genai.types import GenerateContentConfig
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
+from pydantic import BaseModel, Field, field_validator
 import yaml
-from tavily import TavilyClient
 import json
-from typing import Any, Dict
+from typing import Any, Dict, Iterator
+from urllib.parse import urlsplit
 
-load_dotenv()
+try:
+    from opentelemetry import trace as otel_trace  # Optional: spans are emitted when installed
+except ImportError:
+    otel_trace = None
 
+if TYPE_CHECKING:
+    from google.genai.types import GenerateContentConfig
 
-# Initialize Gemini and Tavily clients
-gemini_api = os.getenv("GEMINI_API_KEY")
-gemini_client = genai.Client()
-tavily_api = os.getenv("TAVILY_API_KEY")
-tavily_client = TavilyClient(tavily_api)
+# PYTHON_DOTENV_DISABLED=1 skips backend/.env, e.g. to start without a developer's credentials
+if os.getenv("PYTHON_DOTENV_DISABLED", "").lower() not in ("1", "true"):
+    load_dotenv()
+
+
+# Provider clients are created on first use rather than at import: their SDKs are slow
+# to import (google-genai alone takes seconds) and they need credentials. Each is a
+# process-wide singleton, closed by the app lifespan. Tests and benchmarks may assign stubs.
+gemini_client: Any = None
+tavily_client: Any = None
+azure_openai_client: Any = None
+
+
+def get_gemini_client() -> Any:
+    global gemini_client
+    if gemini_client is None:
+        from google import genai
+        gemini_client = genai.Client()
+    return gemini_client
+
+
+def get_tavily_client() -> Any:
+    global tavily_client
+    if tavily_client is None:
+        from tavily import AsyncTavilyClient
+        tavily_client = AsyncTavilyClient(os.getenv("TAVILY_API_KEY"), api_base_url=os.getenv("TAVILY_API_BASE_URL"))
+    return tavily_client
+
+
+def get_azure_openai_client() -> Any:
+    global azure_openai_client
+    if azure_openai_client is None:
+        from openai import AzureOpenAI
+        azure_openai_client = AzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version="2024-02-01",
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            max_retries=0  # Retries are handled by upstreams["azure_openai"]
+        )
+    return azure_openai_client
+
+
+def preload_provider_sdks() -> None:
+    """Import the provider SDKs ahead of the first request that needs them (runs on a thread)."""
+    for module in ("google.genai.types", "google.genai", "openai", "tavily"):
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print(f"Could not preload {module}: {e}")
+
+
+async def close_provider_clients() -> None:
+    """Release the provider clients' connection pools; they are rebuilt on next use."""
+    global gemini_client, tavily_client, azure_openai_client
+    for name, close in [
+        ("gemini", lambda: gemini_client.aio.aclose()),
+        ("tavily", lambda: tavily_client.close()),
+        ("azure_openai", lambda: azure_openai_client.close()),
+    ]:
+        try:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+        except AttributeError:
+            pass  # Not created yet, or a stub without close()
+        except Exception as e:
+            print(f"Closing the {name} client failed: {e}")
+    gemini_client = tavily_client = azure_openai_client = None
+
+# Fan-out limit for the per-URL Tavily calls in the content pipeline
+TAVILY_CONCURRENCY = int(os.getenv("TAVILY_CONCURRENCY", "5"))
+# Per-attempt Tavily timeouts; the SDK's own defaults are 60s for search and 150s for map and crawl
+TAVILY_SEARCH_TIMEOUT = float(os.getenv("TAVILY_SEARCH_TIMEOUT", "20"))
+TAVILY_MAP_TIMEOUT = float(os.getenv("TAVILY_MAP_TIMEOUT", "60"))
+TAVILY_CRAWL_TIMEOUT = float(os.getenv("TAVILY_CRAWL_TIMEOUT", "150"))
+
+
+class MetricsRegistry:
+    """
+    In-process counters, gauges and histograms, rendered in the Prometheus text
+    exposition format. Each sample is keyed by its metric name and sorted label pairs.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._samples: Dict[str, Dict[Tuple[Tuple[str, str], ...], Any]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: Optional[Tuple[float, ...]] = None) -> None:
+        self._meta[name] = (kind, help_text)
+        if buckets is not None:
+            self._buckets[name] = buckets
+        self._samples.setdefault(name, {})
+
+    @staticmethod
+    def _labels(labels: Optional[Dict[str, str]]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((labels or {}).items()))
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, amount: float = 1) -> None:
+        samples = self._samples.setdefault(name, {})
+        key = self._labels(labels)
+        samples[key] = samples.get(key, 0) + amount
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        self._samples.setdefault(name, {})[self._labels(labels)] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        samples = self._samples.setdefault(name, {})
+        key = self._labels(labels)
+        histogram = samples.get(key)
+        buckets = self._buckets.get(name, self.BUCKETS)
+        if histogram is None:
+            histogram = samples[key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    @staticmethod
+    def _format(name: str, labels: Tuple[Tuple[str, str], ...], value: float) -> str:
+        if labels:
+            pairs = ",".join(
+                '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                for k, v in labels
+            )
+            return f"{name}{{{pairs}}} {value}"
+        return f"{name} {value}"
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._samples):
+            kind, help_text = self._meta.get(name, ("untyped", ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(self._samples[name].items()):
+                if kind != "histogram":
+                    lines.append(self._format(name, labels, value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(self._buckets.get(name, self.BUCKETS), value["buckets"]):
+                    cumulative += count
+                    lines.append(self._format(f"{name}_bucket", labels + (("le", str(bound)),), cumulative))
+                lines.append(self._format(f"{name}_bucket", labels + (("le", "+Inf"),), value["count"]))
+                lines.append(self._format(f"{name}_sum", labels, round(value["sum"], 6)))
+                lines.append(self._format(f"{name}_count", labels, value["count"]))
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("creatorcompass_stage_duration_seconds", "histogram",
+                 "Duration of each pipeline stage and upstream call")
+metrics.describe("creatorcompass_stage_in_flight", "gauge", "Stage executions currently running")
+metrics.describe("creatorcompass_upstream_errors_total", "counter", "Failed upstream calls by upstream and stage")
+metrics.describe("creatorcompass_http_request_duration_seconds", "histogram", "HTTP request duration, including streamed bodies")
+metrics.describe("creatorcompass_http_requests_in_flight", "gauge", "HTTP requests currently being served")
+metrics.describe("creatorcompass_event_loop_lag_seconds", "histogram", "How late the event loop wakes a sleeping task",
+                 buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+otel_tracer = otel_trace.get_tracer("creatorcompass") if otel_trace is not None else None
+
+# Stage durations of the current request, reported back in its Server-Timing header
+_server_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("server_timings", default=None)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Record a stage that was timed elsewhere (e.g. on a worker thread) for the current request."""
+    metrics.observe("creatorcompass_stage_duration_seconds", seconds, {"stage": stage})
+    timings = _server_timings.get()
+    if timings is not None:
+        # Concurrent calls of one stage overlap, so the longest one is what the request waited for
+        timings[stage] = max(timings.get(stage, 0.0), seconds)
+
+
+@contextmanager
+def stage_timer(stage: str, upstream: Optional[str] = None) -> Iterator[None]:
+    """
+    Time a block as `stage`: records its duration histogram and in-flight gauge,
+    counts failures against `upstream`, and wraps it in an OpenTelemetry span when available.
+    """
+    labels = {"stage": stage}
+    metrics.inc("creatorcompass_stage_in_flight", labels)
+    span = otel_tracer.start_as_current_span(stage) if otel_tracer is not None else nullcontext()
+    started = time.perf_counter()
+    try:
+        with span:
+            yield
+    except BaseException as e:
+        # Cancellation (client gone, hedge lost, outer timeout) is ours, not the upstream's
+        if upstream is not None and isinstance(e, Exception):
+            metrics.inc("creatorcompass_upstream_errors_total", {
+                "upstream": upstream,
+                "stage": stage,
+                "error": "timeout" if isinstance(e, asyncio.TimeoutError) else type(e).__name__
+            })
+        raise
+    finally:
+        metrics.inc("creatorcompass_stage_in_flight", labels, -1)
+        record_stage(stage, time.perf_counter() - started)
+
+
+async def monitor_event_loop_lag(interval: float = 0.05) -> None:
+    """Sample event loop lag: blocking work on the loop delays this task's wakeups."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.observe("creatorcompass_event_loop_lag_seconds", max(0.0, time.perf_counter() - started - interval))
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware that times every HTTP request and adds `X-Generation-Time`
+    and a `Server-Timing` breakdown of the stages that finished before the
+    response headers were sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        token = _server_timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - started
+                entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+                entries.append(f"total;dur={elapsed * 1000:.1f}")
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-generation-time", f"{elapsed:.4f}".encode("latin-1")),
+                    (b"server-timing", ", ".join(entries).encode("latin-1")),
+                ]
+            await send(message)
+
+        metrics.inc("creatorcompass_http_requests_in_flight")
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _server_timings.reset(token)
+            metrics.inc("creatorcompass_http_requests_in_flight", amount=-1)
+            route = scope.get("route")
+            metrics.observe("creatorcompass_http_request_duration_seconds", time.perf_counter() - started, {
+                "method": scope["method"],
+                "path": getattr(route, "path", "unmatched"),
+                "status": str(status)
+            })
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical work. The first caller for a key starts the
+    upstream call; callers arriving while it is in flight await the same result
+    (or exception). A waiter being cancelled does not cancel the shared call
+    unless it was the last one waiting.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = {"task": asyncio.ensure_future(factory()), "waiters": 0}
+            self._inflight[key] = flight
+            flight["task"].add_done_callback(lambda _, key=key, flight=flight: self._forget(key, flight))
+        else:
+            self.coalesced += 1
+
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(flight["task"])
+        finally:
+            flight["waiters"] -= 1
+            if flight["waiters"] == 0 and not flight["task"].done():
+                # Every waiter went away. Forget the task now, not when it finishes
+                # unwinding, so a new caller starts a fresh call instead of joining it
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                flight["task"].cancel()
+
+    def _forget(self, key: str, flight: Dict[str, Any]) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        if not flight["task"].cancelled():
+            flight["task"].exception()  # Mark as retrieved; waiters already re-raised it
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
+
+
+thumbnail_flight = SingleFlight("thumbnail")
+content_flight = SingleFlight("content")
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, bursting up to `capacity`.
+    Waiters are served in arrival order. `penalize()` empties the bucket and
+    holds everyone back, e.g. for an upstream 429's Retry-After.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.waited = 0.0
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                delay = max(self._paused_until - now, (tokens - self._tokens) / self.rate)
+                if delay <= 0:
+                    self._tokens -= tokens
+                    return
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens only if they are available right now."""
+        if self._lock.locked():
+            return False
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if now < self._paused_until or self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    def available(self) -> float:
+        """Tokens that could be taken right now, without taking them."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return 0.0
+        return min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+
+    def penalize(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    def stats(self) -> Dict[str, float]:
+        return {"rate_per_minute": round(self.rate * 60, 3), "capacity": self.capacity, "waited_seconds": round(self.waited, 3)}
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a provider is down. Opens after `failure_threshold` consecutive
+    failures; after `reset_timeout` seconds a single probe call is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def release(self) -> None:
+        """Give up a half-open probe without an outcome (the call was cancelled)."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+# The Tavily SDK raises these without keeping the HTTP status
+_TAVILY_ERROR_STATUS = {
+    "UsageLimitExceededError": 429,
+    "ForbiddenError": 403,
+    "InvalidAPIKeyError": 401,
+    "MissingAPIKeyError": 401,
+    "BadRequestError": 400,
+}
+
+
+def _error_status(e: BaseException) -> Optional[int]:
+    """HTTP status carried by an SDK exception (openai, google-genai, tavily, httpx, HTTPException), if any."""
+    for attribute in ("status_code", "code"):
+        value = getattr(e, attribute, None)
+        if isinstance(value, int):
+            return value
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status
+    return _TAVILY_ERROR_STATUS.get(type(e).__name__) if type(e).__module__.startswith("tavily") else None
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    """Seconds from the Retry-After header of an SDK exception's response or an HTTPException, if any."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or getattr(e, "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("retry-after", headers.get("Retry-After"))))
+    except (TypeError, ValueError):
+        return None
+
+
+# At most one retry message per provider per this many seconds; the rest are only counted
+UPSTREAM_RETRY_LOG_INTERVAL = float(os.getenv("UPSTREAM_RETRY_LOG_INTERVAL", "10"))
+
+
+class Upstream:
+    """
+    Resilience policy shared by every call to one provider:
+    - a client-side token bucket so we stay inside the provider's quota,
+    - retries with full-jitter exponential backoff, waiting out Retry-After on 429s,
+    - hedging for idempotent calls: when an attempt runs past the recent p95 latency
+      a second one is started and whichever finishes first wins,
+    - a circuit breaker that turns calls into an immediate 503 while the provider is down.
+    Client errors (4xx other than 408/429) are neither retried nor held against the provider.
+    """
+
+    HEDGE_MIN_SAMPLES = 20
+
+    def __init__(
+            self,
+            name: str,
+            bucket: TokenBucket,
+            timeout: float,
+            max_attempts: int = 3,
+            backoff_base: float = 0.5,
+            backoff_max: float = 8.0,
+            hedge: bool = True,
+            hedge_min_delay: float = 0.05,
+            breaker: Optional[CircuitBreaker] = None
+    ):
+        self.name = name
+        self.bucket = bucket
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, reset_timeout=30)
+        self.counts = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "rejected": 0, "failures": 0}
+        # Per stage: search, map and crawl latencies differ by orders of magnitude
+        self._latencies: Dict[Optional[str], collections.deque] = collections.defaultdict(
+            lambda: collections.deque(maxlen=200)
+        )
+        self._retry_logged_at = float("-inf")
+        self._retries_unlogged = 0
+
+    async def call(
+            self,
+            stage: Optional[str],
+            factory: Callable[[], Awaitable[Any]],
+            idempotent: bool = True,
+            timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Await `factory()` under this provider's policy. `stage` names the attempts in metrics;
+        `timeout` overrides the provider's per-attempt timeout. Calls with side effects or
+        an expensive result (a DALL-E image, a site crawl) pass `idempotent=False`: they are
+        not hedged, and only retried when the provider answered 429 or 503, i.e. it refused
+        the request outright; a timeout or other 5xx could mean the work was done and billed.
+        Cheap reads (Tavily search and map, Gemini text) stay idempotent and may be paid for
+        twice: a hedge only fires past the stage's p95 latency and only with a spare token,
+        so it adds about 5% to their cost in exchange for cutting the tail. Set
+        UPSTREAM_<NAME>_HEDGE=0 to trade that back.
+        """
+        self.counts["calls"] += 1
+        for attempt in range(1, self.max_attempts + 1):
+            if not self.breaker.allow():
+                self.counts["rejected"] += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"{self.name} is unavailable, failing fast while it recovers",
+                    headers={"Retry-After": str(math.ceil(self.breaker.retry_after()) or 1)}
+                )
+            try:
+                # Inside the try: a probe cancelled while waiting for a token must still be released
+                await self.bucket.acquire()
+                hedge_after = self._hedge_delay(stage) if idempotent else None
+                result = await (
+                    self._hedged(stage, factory, hedge_after, timeout) if hedge_after else self._attempt(stage, factory, timeout)
+                )
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                status = _error_status(e)
+                if not (status is None or status in (408, 429) or status >= 500):
+                    self.breaker.record_success()  # The provider answered; the request was at fault
+                    raise
+                self.breaker.record_failure()
+                retry_after = _retry_after(e)
+                if status == 429:
+                    self.bucket.penalize(retry_after if retry_after is not None else self.backoff_base)
+                if attempt == self.max_attempts or not (idempotent or status in (429, 503)):
+                    self.counts["failures"] += 1
+                    raise
+                self.counts["retries"] += 1
+                delay = retry_after if retry_after is not None else \
+                    random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                self._log_retry(e, attempt, delay)
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def _log_retry(self, e: Exception, attempt: int, delay: float) -> None:
+        now = time.monotonic()
+        if now - self._retry_logged_at < UPSTREAM_RETRY_LOG_INTERVAL:
+            self._retries_unlogged += 1
+            return
+        suppressed = f" ({self._retries_unlogged} more retries since the last message)" if self._retries_unlogged else ""
+        print(f"{self.name} call failed ({type(e).__name__}: {e}); retry {attempt} in {delay:.2f}s{suppressed}")
+        self._retry_logged_at = now
+        self._retries_unlogged = 0
+
+    def budget(self, timeout: Optional[float] = None) -> float:
+        """
+        How long a call can take when every attempt times out, not counting rate-limit waits.
+        Outer timeouts around `call` must be at least this, or they cut off the retries.
+        """
+        return self.max_attempts * (timeout or self.timeout) + (self.max_attempts - 1) * self.backoff_max
+
+    async def _attempt(self, stage: Optional[str], factory: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        started = time.perf_counter()
+        with stage_timer(stage, upstream=self.name) if stage else nullcontext():
+            result = await asyncio.wait_for(factory(), timeout or self.timeout)
+        self._latencies[stage].append(time.perf_counter() - started)
+        return result
+
+    def _hedge_delay(self, stage: Optional[str]) -> Optional[float]:
+        latencies = self._latencies.get(stage)
+        if not self.hedge or latencies is None or len(latencies) < self.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95) - 1])
+
+    async def _hedged(
+            self,
+            stage: Optional[str],
+            factory: Callable[[], Awaitable[Any]],
+            hedge_after: float,
+            timeout: Optional[float] = None
+    ) -> Any:
+        primary = asyncio.ensure_future(self._attempt(stage, factory, timeout))
+        tasks = {primary}
+        started = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done and self.bucket.try_acquire():
+                self.counts["hedges"] += 1
+                started.append(asyncio.ensure_future(self._attempt(stage, factory, timeout)))
+                tasks.add(started[-1])
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.counts["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in started:
+                task.cancel()
+                # A loser may have failed alongside the winner or still fail while unwinding;
+                # consume it so it is not logged as unretrieved
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "circuit": self.breaker.state,
+            "hedge_after": {stage or "default": self._hedge_delay(stage) for stage in list(self._latencies)},
+            **self.bucket.stats()
+        }
+
+
+def _upstream_from_env(name: str, rate_per_minute: float, burst: float, timeout: float, hedge: bool) -> Upstream:
+    """Build a provider's policy; each setting can be overridden with UPSTREAM_<NAME>_<SETTING>."""
+    def setting(key: str, default: Any) -> str:
+        return os.getenv(f"UPSTREAM_{name.upper()}_{key}", os.getenv(f"UPSTREAM_{key}", str(default)))
+
+    return Upstream(
+        name,
+        bucket=TokenBucket(rate=float(setting("RATE_PER_MINUTE", rate_per_minute)) / 60, capacity=float(setting("BURST", burst))),
+        timeout=float(setting("TIMEOUT", timeout)),
+        max_attempts=int(setting("MAX_ATTEMPTS", 3)),
+        backoff_base=float(setting("BACKOFF_BASE", 0.5)),
+        backoff_max=float(setting("BACKOFF_MAX", 8)),
+        hedge=setting("HEDGE", "1" if hedge else "0") == "1",
+        breaker=CircuitBreaker(
+            failure_threshold=int(setting("BREAKER_FAILURES", 5)),
+            reset_timeout=float(setting("BREAKER_RESET", 30))
+        )
+    )
+
+
+upstreams = {
+    # DALL-E generations are expensive and not hedged; the limit matches the deployment's quota
+    "azure_openai": _upstream_from_env(
+        "azure_openai", float(os.getenv("DALLE_RATE_PER_MINUTE", "6")), float(os.getenv("DALLE_BURST", "2")),
+        timeout=120, hedge=False
+    ),
+    "gemini": _upstream_from_env("gemini", 1000, 20, timeout=60, hedge=True),
+    # Map and crawl pass their own, longer timeouts; this one applies to search
+    "tavily": _upstream_from_env("tavily", 1000, 20, timeout=TAVILY_SEARCH_TIMEOUT, hedge=True),
+}
+
+# Shared HTTP client for image downloads; opened and closed by the app lifespan
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+IMAGE_DOWNLOAD_TIMEOUT = float(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", "30"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+
+http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared pooled HTTP client, creating it on first use."""
+    global http_client
+    if http_client is None or http_client.is_closed:
+        try:
+            import h2  # noqa: F401  HTTP/2 support is optional
+            http2 = True
+        except ImportError:
+            http2 = False
+        http_client = httpx.AsyncClient(
+            http2=http2,
+            timeout=IMAGE_DOWNLOAD_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=60
+            )
+        )
+    return http_client
+
+
+async def close_http_client() -> None:
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+# Set while a request admitted by ImageWorkerPool.admit() runs; its jobs are never rejected
+_image_admitted: ContextVar[bool] = ContextVar("image_admitted", default=False)
+
+
+class ImageWorkerPool:
+    """
+    Bounded thread pool for CPU-bound Pillow work (decode, resize, overlay, encode).
+    Pillow releases the GIL for most of these, so threads run them in parallel
+    while the event loop stays free. Once `queue_limit` jobs are pending, new work
+    is rejected with 429.
+    """
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _admit(self) -> None:
+        if self.pending >= self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Image processing is at capacity, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        """
+        Check capacity when a request arrives, before its source image is paid for, so an
+        overloaded pool turns it away without wasting a DALL-E call. No slot is held while
+        the image is generated; jobs run inside the block queue for a worker instead of
+        being rejected, since by then the image has been paid for.
+        """
+        self._admit()
+        token = _image_admitted.set(True)
+        try:
+            yield
+        finally:
+            _image_admitted.reset(token)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-worker")
+        if not _image_admitted.get():
+            self._admit()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_pool = ImageWorkerPool(
+    workers=int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    queue_limit=int(os.getenv("IMAGE_QUEUE_LIMIT", "32"))
+)
+
+
+class FontRegistry:
+    """
+    Resolves the overlay font once from a list of candidates and caches
+    FreeTypeFont objects per (font, size), so overlays never re-parse font files.
+    """
+
+    def __init__(self, candidates: List[str]):
+        self.candidates = candidates
+        self._resolved = False
+        self._path: Optional[str] = None
+        self._fonts: Dict[Tuple[Optional[str], int], ImageFont.FreeTypeFont] = {}
+
+    @property
+    def path(self) -> Optional[str]:
+        """The first candidate font Pillow can load, or None to use Pillow's bundled font."""
+        if not self._resolved:
+            for candidate in self.candidates:
+                try:
+                    self._path = ImageFont.truetype(candidate, 10).path
+                    break
+                except OSError:
+                    continue
+            self._resolved = True
+        return self._path
+
+    def get(self, size: int) -> ImageFont.FreeTypeFont:
+        key = (self.path, size)
+        font = self._fonts.get(key)
+        if font is None:
+            font = ImageFont.truetype(self.path, size) if self.path else ImageFont.load_default(size=size)
+            self._fonts[key] = font
+        return font
+
+
+class ThumbnailStore:
+    """
+    Filesystem store for processed thumbnails. Files are named by the SHA-256 of
+    their bytes and sharded into two levels of directories (ab/cd/abcd....jpg),
+    so identical renders are stored once and an ID always maps to the same bytes.
+    """
+
+    MEDIA_TYPES = {"jpg": "image/jpeg", "webp": "image/webp", "avif": "image/avif"}
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, thumbnail_id: str, extension: str) -> str:
+        return os.path.join(self.root, thumbnail_id[:2], thumbnail_id[2:4], f"{thumbnail_id}.{extension}")
+
+    def save(self, data: Union[bytes, memoryview], extension: str = "jpg") -> str:
+        """Store `data` (bytes or a memoryview) and return its thumbnail ID. Blocking; call from a worker thread."""
+        thumbnail_id = hashlib.sha256(data).hexdigest()
+        path = self._path(thumbnail_id, extension)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)  # Atomic, so readers never see a partial file
+        return thumbnail_id
+
+    def find(self, thumbnail_id: str) -> Optional[Tuple[str, str]]:
+        """Return (path, media type) for a stored thumbnail, or None."""
+        if len(thumbnail_id) != 64 or any(c not in "0123456789abcdef" for c in thumbnail_id):
+            return None
+        for extension, media_type in self.MEDIA_TYPES.items():
+            path = self._path(thumbnail_id, extension)
+            if os.path.exists(path):
+                return path, media_type
+        return None
+
+
+# JPEGs sent as binary responses are progressive so clients can draw a preview before the
+# last byte arrives. Progressive encoding costs about 3.5x the CPU, so stored renditions and
+# JSON-mode renders, which are fetched later or not at all, stay baseline
+JPEG_PROGRESSIVE = os.getenv("JPEG_PROGRESSIVE", "1") == "1"
+
+# Rendition sizes the pipeline can produce, largest first, and the encoders per format
+RENDITION_SIZES = {"1280x720": (1280, 720), "640x360": (640, 360), "320x180": (320, 180)}
+RENDITION_FORMATS = {
+    "jpeg": ("JPEG", "jpg", {"quality": 95}),
+    "webp": ("WEBP", "webp", {"quality": 85, "method": 4}),
+}
+if features.check("avif"):
+    RENDITION_FORMATS["avif"] = ("AVIF", "avif", {"quality": 60})
+
+thumbnail_store = ThumbnailStore(
+    os.getenv("THUMBNAIL_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "thumbnails"))
+)
+
+
+# Overlay fonts in order of preference; override with a comma-separated THUMBNAIL_FONTS
+font_registry = FontRegistry([
+    font.strip() for font in os.getenv(
+        "THUMBNAIL_FONTS",
+        "arialbd.ttf,Arial Bold.ttf,arial.ttf,DejaVuSans-Bold.ttf,LiberationSans-Bold.ttf"
+    ).split(",") if font.strip()
+])
 
 # Pydantic models for request/response
 class ThumbnailRequest(BaseModel):
     title: str = Field(..., description="Video title/topic for thumbnail generation")
     overlay_text: Optional[str] = Field(None, description="Text to overlay on the thumbnail")
-    # style: str = Field("vibrant and eye-catching", description="Visual style of the thumbnail")
-    # theme: str = Field("modern", description="Theme/genre of the thumbnail")
-    # additional_elements: Optional[List[str]] = Field(None, description="Additional elements to include")
-    # font_size: int = Field(60, ge=20, le=120, description="Font size for overlay text")
-    # text_color: str = Field("white", description="Color of the overlay text")
-    # stroke_color: str = Field("black", description="Color of the text stroke")
-    # stroke_width: int = Field(3, ge=0, le=10, description="Width of the text stroke")
-    # position: str = Field("center", description="Text position: center, top, or bottom")
-    # quality: str = Field("hd", description="Image quality: standard or hd")
+    sizes: Optional[List[str]] = Field(None, description="Renditions to produce, e.g. 1280x720, 640x360, 320x180")
+    formats: Optional[List[str]] = Field(None, description="Rendition formats: jpeg, webp, avif (if supported)")
+    style: str = Field("vibrant and eye-catching", description="Visual style of the thumbnail")
+    theme: str = Field("modern", description="Theme/genre of the thumbnail")
+    additional_elements: Optional[List[str]] = Field(None, description="Additional elements to include")
+    font_size: int = Field(60, ge=20, le=120, description="Font size for overlay text")
+    text_color: str = Field("white", description="Color of the overlay text")
+    stroke_color: str = Field("black", description="Color of the text stroke")
+    stroke_width: int = Field(3, ge=0, le=10, description="Width of the text stroke")
+    position: str = Field("center", description="Text position: center, top, or bottom")
+    auto_fit: bool = Field(False, description="Wrap and size the overlay text to fill the thumbnail")
+    quality: str = Field("hd", pattern="^(standard|hd)$", description="Image quality: standard or hd")
+
+    # Checked when the request is parsed, so an unsupported rendition never costs a DALL-E call
+    @field_validator("sizes")
+    @classmethod
+    def _check_sizes(cls, sizes: Optional[List[str]]) -> Optional[List[str]]:
+        invalid = [size for size in sizes or [] if size not in RENDITION_SIZES]
+        if invalid:
+            raise ValueError(f"Unsupported sizes {invalid}. Sizes: {', '.join(RENDITION_SIZES)}")
+        return sizes
+
+    @field_validator("formats")
+    @classmethod
+    def _check_formats(cls, formats: Optional[List[str]]) -> Optional[List[str]]:
+        invalid = [image_format for image_format in formats or [] if image_format not in RENDITION_FORMATS]
+        if invalid:
+            raise ValueError(f"Unsupported formats {invalid}. Formats: {', '.join(RENDITION_FORMATS)}")
+        return formats
+
+
+@functools.lru_cache(maxsize=256)
+def thumbnail_prompt_template(style: str, theme: str, additional_elements: Tuple[str, ...] = ()) -> Tuple[str, str]:
+    """
+    The DALL-E prompt for a style, theme and element list, split around the title.
+    Built once per combination; a prompt is then `prefix + title + suffix`.
+    """
+    prefix = 'Create a YouTube thumbnail image for a video titled "'
+    suffix = f"""".
+
+Style: {style}
+Theme: {theme}
+
+Background: A minimal and energetic pattern,
+with high contrast colors such as red, yellow, or orange to create urgency and excitement.
+
+Text Layout: Use large, bold, uppercase text split across 2–3 segments
+Combine contrasting color blocks (e.g., black, white, yellow) behind text for emphasis
+Include dynamic font choices such as sans-serif, bold, and condensed styles
+Apply mild shadows or outlines to ensure legibility
+
+Visual Elements:Add hand-drawn arrows or shapes pointing toward text to guide the viewer's eye
+Optionally include emoji-style icons or comic effects like bursts, stars, or exclamation marks
+
+Human Element: Place a person or character on one side (left or right), with a strong emotional expression (e.g., surprise, excitement, shock)
+Use a sticker-style white border or cut-out effect around them for emphasis
+
+Requirements:
+- 16:9 aspect ratio (landscape orientation)
+- High contrast and vibrant colors that stand out
+- Clear focal point that draws attention
+- Professional and polished appearance
+- Optimized for small display sizes (will be viewed as small thumbnails)
+- No text overlay (text will be added separately)
+- Eye-catching and clickable design
+"""
+    if additional_elements:
+        suffix += f"\n\nAdditional elements to include: {', '.join(additional_elements)}"
+    suffix += "\n\nThe image should be visually striking and make viewers want to click on the video."
+    return prefix, suffix
 
 
 class ThumbnailResponse(BaseModel):
@@ -52,13 +980,18 @@ class ThumbnailResponse(BaseModel):
 
 class AsyncThumbnailGenerator:
     def __init__(self):
-        self.client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version="2024-02-01",
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
+        self._client: Any = None
         self.thumbnail_size = (1280, 720)
 
+    @property
+    def client(self) -> Any:
+        """The Azure OpenAI client: the shared lazy singleton unless one was assigned."""
+        return self._client if self._client is not None else get_azure_openai_client()
+
+    @client.setter
+    def client(self, value: Any) -> None:
+        self._client = value
+
     async def generate_thumbnail(
             self,
             title: str,
@@ -67,23 +1000,52 @@ class AsyncThumbnailGenerator:
             additional_elements: Optional[List[str]] = None,
             quality: str = "hd"
     ) -> str:
-        """Generate thumbnail using DALL-E 3."""
+        """Generate thumbnail using DALL-E 3. Identical concurrent requests share one DALL-E call."""
+        key = ResponseCache.make_key("thumbnail", [title, style, theme, additional_elements or [], quality])
+        return await thumbnail_flight.do(
+            key, lambda: self._generate_thumbnail(title, style, theme, additional_elements, quality)
+        )
+
+    async def _generate_thumbnail(
+            self,
+            title: str,
+            style: str,
+            theme: str,
+            additional_elements: Optional[List[str]],
+            quality: str
+    ) -> str:
         prompt = self._build_prompt(title, style, theme, additional_elements)
+        from openai import RateLimitError
 
         try:
+            # Resolve the client here, not in the worker thread, so it is only ever built once
+            client = self.client
             # Run the OpenAI API call in a thread to avoid blocking
             loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.client.images.generate(
-                    model="dall-e-3",
-                    prompt=prompt,
-                    size="1792x1024",
-                    quality='hd',
-                    n=1,
-                )
+            response = await upstreams["azure_openai"].call(
+                "dalle",
+                lambda: loop.run_in_executor(
+                    None,
+                    lambda: client.images.generate(
+                        model="dall-e-3",
+                        prompt=prompt,
+                        size="1792x1024",
+                        quality=quality,
+                        n=1,
+                    )
+                ),
+                idempotent=False
             )
             return response.data[0].url
+        except RateLimitError as e:
+            # Still limited after the retries; the shared bucket is already holding calls back
+            raise HTTPException(
+                status_code=429,
+                detail="DALL-E rate limit reached, please retry shortly",
+                headers={"Retry-After": str(math.ceil(_retry_after(e) or 10))}
+            )
+        except HTTPException:
+            raise
         except Exception as e:
             traceback.print_exc()
             raise HTTPException(status_code=500, detail=f"Error generating thumbnail: {str(e)}")
@@ -96,79 +1058,230 @@ class AsyncThumbnailGenerator:
             additional_elements: Optional[List[str]] = None
     ) -> str:
         """Build the DALL-E prompt for thumbnail generation."""
-        prompt = f"""Create a YouTube thumbnail image for a video titled "{title}". 
-        
-        Background: A minimal and energetic pattern, 
-        with high contrast colors such as red, yellow, or orange to create urgency and excitement.
-        
-        Text Layout: Use large, bold, uppercase text split across 2–3 segments 
-        Combine contrasting color blocks (e.g., black, white, yellow) behind text for emphasis
-        Include dynamic font choices such as sans-serif, bold, and condensed styles
-        Apply mild shadows or outlines to ensure legibility
-        
-        Visual Elements:Add hand-drawn arrows or shapes pointing toward text to guide the viewer's eye
-        Optionally include emoji-style icons or comic effects like bursts, stars, or exclamation marks
-        
-        Human Element: Place a person or character on one side (left or right), with a strong emotional expression (e.g., surprise, excitement, shock)
-        Use a sticker-style white border or cut-out effect around them for emphasis
-        
-        Requirements:
-        - 16:9 aspect ratio (landscape orientation)
-        - High contrast and vibrant colors that stand out
-        - Clear focal point that draws attention
-        - Professional and polished appearance
-        - Optimized for small display sizes (will be viewed as small thumbnails)
-        - No text overlay (text will be added separately)
-        - Eye-catching and clickable design
-        """
-
-        if additional_elements:
-            prompt += f"\n\nAdditional elements to include: {', '.join(additional_elements)}"
-
-        prompt += "\n\nThe image should be visually striking and make viewers want to click on the video."
-        return prompt
+        prefix, suffix = thumbnail_prompt_template(style, theme, tuple(additional_elements or ()))
+        return prefix + title + suffix
 
     async def download_and_process_image(
             self,
-            image_url: str,
+            image_url: Optional[str],
             overlay_text: Optional[str] = None,
             font_size: int = 60,
             text_color: str = "white",
             stroke_color: str = "black",
             stroke_width: int = 3,
-            position: str = "center"
+            position: str = "center",
+            auto_fit: bool = False,
+            timings: Optional[Dict[str, float]] = None,
+            source: Optional[bytes] = None,
+            progressive: bool = False
     ) -> io.BytesIO:
-        """Download image and optionally add text overlay."""
+        """
+        Download image and optionally add text overlay.
+        Processing runs on the image worker pool; per-stage durations in seconds
+        are written into `timings` when a dict is passed. Pass the image bytes as
+        `source` to skip the download, and `progressive` to encode a progressive JPEG.
+        """
+        timings = {} if timings is None else timings
         try:
             # Download the image
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.get(image_url, timeout=30)
+            if source is not None:
+                buffer = io.BytesIO(source)
+            else:
+                started = time.perf_counter()
+                buffer = await self.download_image(image_url)
+                timings["download"] = time.perf_counter() - started
+
+            img_bytes = await image_pool.run(
+                self._process_image, buffer, overlay_text, font_size, text_color,
+                stroke_color, stroke_width, position, timings, auto_fit, progressive
             )
-            response.raise_for_status()
+            # Worker-thread stages are recorded here, back in the request's context
+            for stage in ("decode", "resize", "overlay", "encode"):
+                if stage in timings:
+                    record_stage(stage, timings[stage])
+            return img_bytes
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
-            # Process the image
-            img = Image.open(io.BytesIO(response.content))
-            img_resized = img.resize(self.thumbnail_size, Image.Resampling.LANCZOS)
+    def _process_image(
+            self,
+            buffer: io.BytesIO,
+            overlay_text: Optional[str],
+            font_size: int,
+            text_color: str,
+            stroke_color: str,
+            stroke_width: int,
+            position: str,
+            timings: Dict[str, float],
+            auto_fit: bool = False,
+            progressive: bool = False
+    ) -> io.BytesIO:
+        """Decode, resize, overlay and encode. CPU-bound; runs on a worker thread."""
+        img_resized = self._compose_image(
+            buffer, overlay_text, font_size, text_color, stroke_color, stroke_width, position, timings, auto_fit
+        )
 
-            # Add text overlay if specified
-            if overlay_text:
-                img_resized = self._add_text_overlay(
-                    img_resized, overlay_text, font_size, text_color,
-                    stroke_color, stroke_width, position
-                )
+        # Convert to bytes
+        started = time.perf_counter()
+        img_bytes = io.BytesIO()
+        img_resized.save(img_bytes, format='JPEG', progressive=progressive, **RENDITION_FORMATS["jpeg"][2])
+        img_bytes.seek(0)
+        timings["encode"] = time.perf_counter() - started
 
-            # Convert to bytes
-            img_bytes = io.BytesIO()
-            img_resized.save(img_bytes, format='JPEG', quality=95)
-            img_bytes.seek(0)
+        return img_bytes
 
-            return img_bytes
+    def _compose_image(
+            self,
+            buffer: io.BytesIO,
+            overlay_text: Optional[str],
+            font_size: int,
+            text_color: str,
+            stroke_color: str,
+            stroke_width: int,
+            position: str,
+            timings: Dict[str, float],
+            auto_fit: bool = False
+    ) -> Image.Image:
+        """Decode the source, resize it to the thumbnail size and draw the overlay."""
+        started = time.perf_counter()
+        img = Image.open(buffer)
+        img.draft("RGB", self.thumbnail_size)  # Lets JPEG sources decode at reduced scale
+        img.load()
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        timings["decode"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        img_resized = img.resize(self.thumbnail_size, Image.Resampling.LANCZOS)
+        timings["resize"] = time.perf_counter() - started
+
+        # Add text overlay if specified
+        if overlay_text:
+            started = time.perf_counter()
+            img_resized = self._add_text_overlay(
+                img_resized, overlay_text, font_size, text_color,
+                stroke_color, stroke_width, position, auto_fit
+            )
+            timings["overlay"] = time.perf_counter() - started
+
+        return img_resized
+
+    async def download_and_render_renditions(
+            self,
+            image_url: Optional[str],
+            sizes: List[str],
+            formats: List[str],
+            overlay_text: Optional[str] = None,
+            font_size: int = 60,
+            text_color: str = "white",
+            stroke_color: str = "black",
+            stroke_width: int = 3,
+            position: str = "center",
+            auto_fit: bool = False,
+            timings: Optional[Dict[str, float]] = None,
+            source: Optional[bytes] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Decode the source once, downscale it in cascade to every requested size and
+        encode all (size, format) variants in parallel on the image worker pool.
+        Each variant is stored in the thumbnail store; returns the manifest.
+        Pass the image bytes as `source` to skip the download.
+        """
+        timings = {} if timings is None else timings
+        try:
+            if source is not None:
+                buffer = io.BytesIO(source)
+            else:
+                started = time.perf_counter()
+                buffer = await self.download_image(image_url)
+                timings["download"] = time.perf_counter() - started
+
+            base = await image_pool.run(
+                self._compose_image, buffer, overlay_text, font_size, text_color,
+                stroke_color, stroke_width, position, timings, auto_fit
+            )
 
+            started = time.perf_counter()
+            scaled = await image_pool.run(self._downscale_cascade, base, [RENDITION_SIZES[size] for size in sizes])
+            timings["downscale"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            variants = [(size, image_format) for size in sizes for image_format in formats]
+            encoded = await asyncio.gather(*(
+                image_pool.run(self._encode_rendition, scaled[RENDITION_SIZES[size]], image_format)
+                for size, image_format in variants
+            ))
+            timings["encode"] = time.perf_counter() - started
+            for stage in ("decode", "resize", "overlay", "downscale", "encode"):
+                if stage in timings:
+                    record_stage(stage, timings[stage])
+
+            manifest = []
+            for (size, image_format), data in zip(variants, encoded):
+                extension = RENDITION_FORMATS[image_format][1]
+                thumbnail_id = await asyncio.to_thread(thumbnail_store.save, data, extension)
+                width, height = RENDITION_SIZES[size]
+                manifest.append({
+                    "thumbnail_id": thumbnail_id,
+                    "path": f"/thumbnails/{thumbnail_id}",
+                    "width": width,
+                    "height": height,
+                    "format": image_format,
+                    "media_type": ThumbnailStore.MEDIA_TYPES[extension],
+                    "bytes": len(data)
+                })
+            return manifest
+
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
+    @staticmethod
+    def _downscale_cascade(img: Image.Image, sizes: List[Tuple[int, int]]) -> Dict[Tuple[int, int], Image.Image]:
+        """
+        Produce every size from the next larger one rather than from the source.
+        Exact integer ratios use Image.reduce (a cheap box filter), anything else a
+        LANCZOS resize with a reducing gap.
+        """
+        scaled: Dict[Tuple[int, int], Image.Image] = {}
+        current = img
+        for size in sorted(set(sizes), reverse=True):
+            factor = current.width // size[0]
+            if current.size == size:
+                result = current
+            elif factor > 1 and current.size == (size[0] * factor, size[1] * factor):
+                result = current.reduce(factor)
+            else:
+                result = current.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+            scaled[size] = current = result
+        return scaled
+
+    @staticmethod
+    def _encode_rendition(img: Image.Image, image_format: str) -> bytes:
+        pil_format, _, options = RENDITION_FORMATS[image_format]
+        output = io.BytesIO()
+        img.save(output, format=pil_format, **options)
+        return output.getvalue()
+
+    async def download_image(self, image_url: str) -> io.BytesIO:
+        """Stream an image into memory over the shared keep-alive connection pool."""
+        with stage_timer("download", upstream="image_host"):
+            async with get_http_client().stream("GET", image_url) as response:
+                response.raise_for_status()
+                if int(response.headers.get("content-length") or 0) > IMAGE_MAX_BYTES:
+                    raise ValueError(f"Image is larger than {IMAGE_MAX_BYTES} bytes")
+                buffer = io.BytesIO()
+                async for chunk in response.aiter_bytes():
+                    buffer.write(chunk)
+                    if buffer.tell() > IMAGE_MAX_BYTES:
+                        raise ValueError(f"Image is larger than {IMAGE_MAX_BYTES} bytes")
+        buffer.seek(0)
+        return buffer
+
     def _add_text_overlay(
             self,
             img: Image.Image,
@@ -177,27 +1290,28 @@ class AsyncThumbnailGenerator:
             text_color: str,
             stroke_color: str,
             stroke_width: int,
-            position: str
+            position: str,
+            auto_fit: bool = False
     ) -> Image.Image:
-        """Add text overlay to image."""
+        """
+        Add text overlay to image.
+        With `auto_fit`, the text is wrapped and sized to fill the image inside
+        the margins and `font_size` is ignored.
+        """
         draw = ImageDraw.Draw(img)
+        img_width, img_height = img.size
 
-        # Try to use a bold font, fall back to default if not available
-        try:
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except:
-            try:
-                font = ImageFont.truetype("Arial Bold.ttf", font_size)
-            except:
-                font = ImageFont.load_default()
+        if auto_fit:
+            font, text = self._fit_text(draw, text, img_width - 100, img_height - 100, stroke_width)
+        else:
+            font = font_registry.get(font_size)
 
         # Get text dimensions
-        bbox = draw.textbbox((0, 0), text, font=font)
+        bbox = draw.multiline_textbbox((0, 0), text, font=font, align="center")
         text_width = bbox[2] - bbox[0]
         text_height = bbox[3] - bbox[1]
 
         # Calculate text position
-        img_width, img_height = img.size
 
         if position == "center":
             x = (img_width - text_width) // 2
@@ -212,24 +1326,83 @@ class AsyncThumbnailGenerator:
             x = (img_width - text_width) // 2
             y = (img_height - text_height) // 2
 
-        # Draw text with stroke
-        if stroke_width > 0:
-            for dx in range(-stroke_width, stroke_width + 1):
-                for dy in range(-stroke_width, stroke_width + 1):
-                    if dx != 0 or dy != 0:
-                        draw.text((x + dx, y + dy), text, font=font, fill=stroke_color)
-
-        # Draw main text
-        draw.text((x, y), text, font=font, fill=text_color)
+        # Draw text and its outline in a single stroked render, offset so the
+        # glyph box (not the line box) lands on the computed position
+        draw.multiline_text(
+            (x - bbox[0], y - bbox[1]), text, font=font, fill=text_color, align="center",
+            stroke_width=stroke_width, stroke_fill=stroke_color
+        )
 
         return img
 
+    @staticmethod
+    def _wrap_text(text: str, font: ImageFont.FreeTypeFont, max_width: int) -> str:
+        """Greedy word wrap using glyph advance widths (no rendering)."""
+        lines: List[str] = []
+        for word in text.split():
+            if lines and font.getlength(f"{lines[-1]} {word}") <= max_width:
+                lines[-1] = f"{lines[-1]} {word}"
+            else:
+                lines.append(word)
+        return "\n".join(lines)
+
+    def _fit_text(
+            self,
+            draw: ImageDraw.ImageDraw,
+            text: str,
+            max_width: int,
+            max_height: int,
+            stroke_width: int,
+            min_size: int = 20,
+            max_size: int = 200
+    ) -> Tuple[ImageFont.FreeTypeFont, str]:
+        """
+        Binary search for the largest font size whose wrapped text fits the box.
+        Sizes are measured from glyph advances and line metrics, never by rendering the text.
+        """
+        best = (font_registry.get(min_size), self._wrap_text(text, font_registry.get(min_size), max_width))
+        low, high = min_size + 1, max_size
+        while low <= high:
+            size = (low + high) // 2
+            font = font_registry.get(size)
+            wrapped = self._wrap_text(text, font, max_width)
+            lines = wrapped.split("\n")
+            # Same line pitch ImageDraw.multiline_text uses with its default spacing of 4
+            line_height = draw.textbbox((0, 0), "A", font=font, stroke_width=stroke_width)[3] + stroke_width + 4
+            width = max(font.getlength(line) for line in lines) + 2 * stroke_width
+            if width <= max_width and line_height * len(lines) <= max_height:
+                best = (font, wrapped)
+                low = size + 1
+            else:
+                high = size - 1
+        return best
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_http_client()
+    await job_queue.start()
+    await preset_pool.start()
+    lag_monitor = asyncio.ensure_future(monitor_event_loop_lag())
+    if os.getenv("PRELOAD_PROVIDER_SDKS", "1") == "1":
+        # Start serving right away; the SDK imports finish in the background
+        asyncio.get_running_loop().run_in_executor(None, preload_provider_sdks)
+    yield
+    lag_monitor.cancel()
+    await preset_pool.stop()
+    await job_queue.stop()
+    await response_cache.flush()
+    await close_http_client()
+    await close_provider_clients()
+    image_pool.shutdown()
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="YouTube Thumbnail Generator API",
     description="Generate custom YouTube thumbnails using OpenAI DALL-E 3",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -238,15 +1411,10 @@ app.add_middleware(
     allow_origins=["http://localhost", "http://localhost:5173", "http://127.0.0.1:3000", "http://127.0.0.1", "*"],
     allow_credentials=False,
     allow_methods=["*"],
-    allow_headers=["*"]
-)
-
-# Global variables (in production, use environment variables)
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2024-02-01",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    allow_headers=["*"],
+    expose_headers=["X-Generation-Time", "Server-Timing", "ETag", "Content-Location", "X-Thumbnail-Id", "X-Thumbnail-Source"]
 )
+app.add_middleware(TimingMiddleware)
 
 generator = AsyncThumbnailGenerator()
 
@@ -295,88 +1463,426 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 
+# Compile every preset's prompt template up front
+for _preset in THUMBNAIL_PRESETS.values():
+    thumbnail_prompt_template(_preset["style"], _preset["theme"], tuple(_preset["additional_elements"]))
+
+
 @app.get("/presets")
 async def get_presets():
     """Get available thumbnail presets."""
     return {"presets": THUMBNAIL_PRESETS}
 
 
-@app.post("/generate/thumbnail", response_class=StreamingResponse)
-async def generate_thumbnail(request: ThumbnailRequest):
+# Pre-generated preset backgrounds; PRESET_POOL_SIZE=0 (the default) disables the warmer
+PRESET_POOL_SIZE = int(os.getenv("PRESET_POOL_SIZE", "0"))
+PRESET_POOL_MAX_USES = int(os.getenv("PRESET_POOL_MAX_USES", "25"))
+PRESET_POOL_INTERVAL = float(os.getenv("PRESET_POOL_INTERVAL", "30"))
+PRESET_POOL_DIR = os.getenv(
+    "PRESET_POOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "preset_pool")
+)
+
+
+class PresetPool:
+    """
+    Background images pre-generated per preset, so a preset request can skip DALL-E
+    and only overlay and encode.
+
+    A background task keeps `size` images per preset, generating one at a time and
+    only while the DALL-E rate limiter is idle (bucket full, circuit closed) so it
+    never competes with user requests. Images are stored already resized to the
+    thumbnail size as lossless PNG, so only the final encode of each request is lossy;
+    they are handed out round-robin and replaced after `max_uses` requests. They are
+    kept in `directory` and reloaded on restart.
     """
-    Generate a YouTube thumbnail and return it as an image.
 
-    - **title**: Video title/topic for thumbnail generation
-    - **overlay_text**: Optional text to overlay on the thumbnail
-    - **style**: Visual style (default: "vibrant and eye-catching")
-    - **theme**: Theme/genre (default: "modern")
-    - **additional_elements**: List of additional elements to include
-    - **font_size**: Font size for overlay text (20-120, default: 60)
-    - **text_color**: Color of overlay text (default: "white")
-    - **stroke_color**: Color of text stroke (default: "black")
-    - **stroke_width**: Width of text stroke (0-10, default: 3)
-    - **position**: Text position - "center", "top", or "bottom" (default: "center")
-    - **quality**: Image quality - "standard" or "hd" (default: "hd")
+    def __init__(self, directory: str, size: int, max_uses: int, interval: float):
+        self.directory = directory
+        self.size = size
+        self.max_uses = max_uses
+        self.interval = interval
+        self._images: Dict[str, collections.deque] = {preset: collections.deque() for preset in THUMBNAIL_PRESETS}
+        self._task: Optional[asyncio.Task] = None
+        self.counts = {"hits": 0, "misses": 0, "generated": 0, "retired": 0, "failures": 0}
+
+    async def take(self, preset: str, request: ThumbnailRequest) -> Optional[bytes]:
+        """A pooled background for `preset`, or None if it is empty or the request changes the preset's look."""
+        config = THUMBNAIL_PRESETS.get(preset)
+        if not self.size or config is None:
+            return None
+        if (request.style, request.theme, request.additional_elements, request.quality) != \
+                (config["style"], config["theme"], config["additional_elements"], "hd"):
+            return None
+        images = self._images[preset]
+        if not images:
+            self.counts["misses"] += 1
+            return None
+        image = images[0]
+        images.rotate(-1)
+        image["uses"] += 1
+        if image["uses"] >= self.max_uses:
+            images.remove(image)
+            self.counts["retired"] += 1
+            try:
+                await asyncio.to_thread(os.remove, image["path"])
+            except OSError:
+                pass
+        self.counts["hits"] += 1
+        return image["data"]
+
+    def _load(self) -> None:
+        for preset, images in self._images.items():
+            folder = os.path.join(self.directory, preset)
+            if not os.path.isdir(folder):
+                continue
+            for name in sorted(os.listdir(folder))[:self.size]:
+                path = os.path.join(folder, name)
+                with open(path, "rb") as file:
+                    images.append({"path": path, "data": file.read(), "uses": 0})
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _prepare(buffer: io.BytesIO) -> bytes:
+        """Resize a generated image to the thumbnail size and encode it losslessly; runs on a worker thread."""
+        img = generator._compose_image(buffer, None, 60, "white", "black", 0, "center", {})
+        output = io.BytesIO()
+        img.save(output, format="PNG")
+        return output.getvalue()
+
+    async def _generate(self, preset: str) -> None:
+        config = THUMBNAIL_PRESETS[preset]
+        with image_pool.admit():
+            image_url = await generator.generate_thumbnail(
+                title=config["theme"],
+                style=config["style"],
+                theme=config["theme"],
+                additional_elements=config["additional_elements"],
+                quality="hd"
+            )
+            data = await image_pool.run(self._prepare, await generator.download_image(image_url))
+        path = os.path.join(self.directory, preset, f"{hashlib.sha256(data).hexdigest()[:16]}.png")
+        await asyncio.to_thread(self._write, path, data)
+        self._images[preset].append({"path": path, "data": data, "uses": 0})
+        self.counts["generated"] += 1
+
+    def _quota_idle(self) -> bool:
+        upstream = upstreams["azure_openai"]
+        return upstream.breaker.state == "closed" and upstream.bucket.available() >= upstream.bucket.capacity
+
+    async def _warm(self) -> None:
+        while True:
+            preset = min(self._images, key=lambda name: len(self._images[name]))
+            if len(self._images[preset]) >= self.size or not self._quota_idle():
+                await asyncio.sleep(self.interval)
+                continue
+            try:
+                await self._generate(preset)
+            except Exception as e:
+                self.counts["failures"] += 1
+                print(f"Preset pool: generating a {preset} background failed ({getattr(e, 'detail', e)})")
+                await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self.size:
+            await asyncio.to_thread(self._load)
+            self._task = asyncio.ensure_future(self._warm())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "size": self.size,
+            "max_uses": self.max_uses,
+            "images": {preset: len(images) for preset, images in self._images.items()}
+        }
+
+
+preset_pool = PresetPool(PRESET_POOL_DIR, PRESET_POOL_SIZE, PRESET_POOL_MAX_USES, PRESET_POOL_INTERVAL)
+
+
+@app.get("/presets/pool")
+async def preset_pool_stats():
+    """Pre-generated backgrounds per preset and how often preset requests used them."""
+    return preset_pool.stats()
+
+
+async def render_thumbnail(request: ThumbnailRequest, preset: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Generate, process and store a thumbnail; returns the response body (shared with thumbnail jobs).
+    With `preset`, a pre-generated background from the preset pool is used when one is available.
     """
-    start_time = datetime.now()
+    body, _ = await render_thumbnail_image(request, preset)
+    return body
 
-    try:
-        print("title", request.title)
+
+async def render_thumbnail_image(
+        request: ThumbnailRequest,
+        preset: Optional[str] = None,
+        progressive: bool = False
+) -> Tuple[Dict[str, Any], Optional[io.BytesIO]]:
+    """
+    Like `render_thumbnail`, but also returns the encoder's output buffer so the image
+    can be served without copying it (None for rendition requests, which are stored).
+    `progressive` applies to that buffer only. Rejected with 429 up front when the image
+    pool is at capacity.
+    """
+    # Check image-processing capacity first: a full pool rejects the request before
+    # DALL-E is called rather than after the image has been paid for
+    with image_pool.admit():
+        return await _render_thumbnail_image(request, preset, progressive)
+
+
+async def _render_thumbnail_image(
+        request: ThumbnailRequest,
+        preset: Optional[str],
+        progressive: bool
+) -> Tuple[Dict[str, Any], Optional[io.BytesIO]]:
+    timings: Dict[str, float] = {}
+
+    source = await preset_pool.take(preset, request) if preset else None
+    if source is not None:
+        image_url = None
+    else:
         # Generate thumbnail using DALL-E 3
+        started = time.perf_counter()
         image_url = await generator.generate_thumbnail(
             title=request.title,
-            # style=request.style,
-            # theme=request.theme,
-            # additional_elements=request.additional_elements,
-            # quality=request.quality
+            style=request.style,
+            theme=request.theme,
+            additional_elements=request.additional_elements,
+            quality=request.quality
         )
+        timings["dalle"] = time.perf_counter() - started
 
-        # Download and process the image
-        img_bytes = await generator.download_and_process_image(
+    if request.sizes or request.formats:
+        sizes = request.sizes or ["1280x720"]
+        formats = request.formats or ["jpeg"]
+        renditions = await generator.download_and_render_renditions(
             image_url=image_url,
-            # overlay_text=request.overlay_text,
-            # font_size=request.font_size,
-            # text_color=request.text_color,
-            # stroke_color=request.stroke_color,
-            # stroke_width=request.stroke_width,
-            # position=request.position
+            sizes=sizes,
+            formats=formats,
+            timings=timings,
+            overlay_text=request.overlay_text,
+            font_size=request.font_size,
+            text_color=request.text_color,
+            stroke_color=request.stroke_color,
+            stroke_width=request.stroke_width,
+            position=request.position,
+            auto_fit=request.auto_fit,
+            source=source
         )
-
-        return JSONResponse({
+        return {
             "thumbnail_url": image_url,
-            "generated_at": datetime.now().isoformat()
-        })
-
-        # Return image as streaming response
-        # return StreamingResponse(
-        #     io.BytesIO(img_bytes.read()),
-        #     media_type="image/jpeg",
-        #     headers={
-        #         "Content-Disposition": f"inline; filename=thumbnail_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg",
-        #         "X-Generation-Time": str((datetime.now() - start_time).total_seconds())
-        #     }
-        # )
+            "source": "dalle" if source is None else "preset_pool",
+            "thumbnail_id": renditions[0]["thumbnail_id"],
+            "thumbnail_path": renditions[0]["path"],
+            "renditions": renditions,
+            "generated_at": datetime.now().isoformat(),
+            "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()}
+        }, None
+
+    # Download and process the image
+    img_bytes = await generator.download_and_process_image(
+        image_url=image_url,
+        timings=timings,
+        overlay_text=request.overlay_text,
+        font_size=request.font_size,
+        text_color=request.text_color,
+        stroke_color=request.stroke_color,
+        stroke_width=request.stroke_width,
+        position=request.position,
+        auto_fit=request.auto_fit,
+        source=source,
+        progressive=progressive
+    )
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Keep the processed render so it can be served again without regenerating.
+    # getbuffer() is a view of the encoder's buffer, not a copy
+    with img_bytes.getbuffer() as view:
+        thumbnail_id = await asyncio.to_thread(thumbnail_store.save, view)
+
+    return {
+        "thumbnail_url": image_url,
+        "source": "dalle" if source is None else "preset_pool",
+        "thumbnail_id": thumbnail_id,
+        "thumbnail_path": f"/thumbnails/{thumbnail_id}",
+        "generated_at": datetime.now().isoformat(),
+        "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()}
+    }, img_bytes
+
+
+# Size of the memoryview slices a binary thumbnail response is written in
+IMAGE_RESPONSE_CHUNK = int(os.getenv("IMAGE_RESPONSE_CHUNK", str(64 * 1024)))
+
+
+def prefers_image(accept: str) -> bool:
+    """True when an Accept header ranks image/jpeg (or image/*) above application/json."""
+    image_q, json_q = 0.0, 0.0
+    for part in accept.split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type.lower() in ("image/jpeg", "image/*"):
+            image_q = max(image_q, q)
+        elif media_type.lower() == "application/json":
+            json_q = max(json_q, q)
+    return image_q > json_q
+
+
+async def thumbnail_response(http_request: Request, request: ThumbnailRequest, preset: Optional[str] = None) -> Response:
+    """
+    Render a thumbnail and answer with JSON, or with the image itself when the
+    Accept header prefers image/jpeg. The image is streamed in memoryview slices
+    of the encoder's buffer, so its bytes are never copied on the way out;
+    rendition requests stream their first JPEG rendition from disk, and are
+    refused with 406 before anything is generated when they ask for no JPEG.
+    """
+    if not prefers_image(http_request.headers.get("accept", "")):
+        return JSONResponse(await render_thumbnail(request, preset), headers={"Vary": "Accept"})
+    if request.formats and "jpeg" not in request.formats:
+        raise HTTPException(
+            status_code=406,
+            detail="Accept asks for image/jpeg but no jpeg rendition was requested; "
+                   "add jpeg to formats or accept application/json",
+            headers={"Vary": "Accept"}
+        )
 
+    body, img_bytes = await render_thumbnail_image(request, preset, progressive=JPEG_PROGRESSIVE)
+    if img_bytes is None:
+        jpeg = next(rendition for rendition in body["renditions"] if rendition["format"] == "jpeg")
+        thumbnail_id, thumbnail_path = jpeg["thumbnail_id"], jpeg["path"]
+    else:
+        thumbnail_id, thumbnail_path = body["thumbnail_id"], body["thumbnail_path"]
+    headers = {
+        "ETag": f'"{thumbnail_id}"',
+        # IDs are content hashes: the bytes behind this ETag never change
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Content-Location": thumbnail_path,
+        "Vary": "Accept",
+        "X-Thumbnail-Id": thumbnail_id,
+        "X-Thumbnail-Source": body["source"],
+    }
+    if img_bytes is None:
+        path, media_type = thumbnail_store.find(thumbnail_id)
+        return FileResponse(path, media_type=media_type, headers=headers)
 
-@app.post("/generate/thumbnail/preset", response_class=StreamingResponse)
-async def generate_thumbnail_preset(
-        preset: str = Query(..., description="Preset name (tech, gaming, educational, lifestyle, cooking, fitness)"),
-        title: str = Query(..., description="Video title/topic"),
+    view = img_bytes.getbuffer()
+    headers["Content-Length"] = str(len(view))
+
+    async def chunks() -> AsyncIterator[memoryview]:
+        try:
+            for start in range(0, len(view), IMAGE_RESPONSE_CHUNK):
+                yield view[start:start + IMAGE_RESPONSE_CHUNK]
+        finally:
+            view.release()
+
+    return StreamingResponse(chunks(), media_type="image/jpeg", headers=headers)
+
+
+_THUMBNAIL_RESPONSES = {
+    200: {
+        "description": "The thumbnail's metadata, or the JPEG itself when `Accept` prefers image/jpeg",
+        "content": {"application/json": {}, "image/jpeg": {}}
+    },
+    406: {"description": "`Accept` prefers image/jpeg but the requested rendition formats exclude jpeg"}
+}
+
+
+@app.post("/generate/thumbnail", responses=_THUMBNAIL_RESPONSES)
+async def generate_thumbnail(request: ThumbnailRequest, http_request: Request):
+    """
+    Generate a YouTube thumbnail. Returns its metadata as JSON, or the image
+    itself (progressive JPEG with immutable caching headers) when the `Accept`
+    header prefers `image/jpeg`.
+
+    - **title**: Video title/topic for thumbnail generation
+    - **overlay_text**: Optional text to overlay on the thumbnail
+    - **style**: Visual style (default: "vibrant and eye-catching")
+    - **theme**: Theme/genre (default: "modern")
+    - **additional_elements**: List of additional elements to include
+    - **font_size**: Font size for overlay text (20-120, default: 60)
+    - **text_color**: Color of overlay text (default: "white")
+    - **stroke_color**: Color of text stroke (default: "black")
+    - **stroke_width**: Width of text stroke (0-10, default: 3)
+    - **position**: Text position - "center", "top", or "bottom" (default: "center")
+    - **auto_fit**: Wrap and size the overlay text to fill the thumbnail (default: false)
+    - **sizes** / **formats**: Produce several renditions (e.g. ["1280x720", "320x180"], ["jpeg", "webp"])
+      and return their manifest
+    - **quality**: Image quality - "standard" or "hd" (default: "hd")
+    """
+    try:
+        return await thumbnail_response(http_request, request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/generate/thumbnail/preset", responses=_THUMBNAIL_RESPONSES)
+async def generate_thumbnail_preset(
+        http_request: Request,
+        preset: str = Query(..., description="Preset name (tech, gaming, educational, lifestyle, cooking, fitness)"),
+        title: str = Query(..., description="Video title/topic"),
         overlay_text: Optional[str] = Query(None, description="Text to overlay on thumbnail"),
         font_size: int = Query(60, ge=20, le=120, description="Font size for overlay text"),
         text_color: str = Query("white", description="Color of overlay text"),
         stroke_color: str = Query("black", description="Color of text stroke"),
         stroke_width: int = Query(3, ge=0, le=10, description="Width of text stroke"),
         position: str = Query("center", description="Text position: center, top, or bottom"),
-        quality: str = Query("hd", description="Image quality: standard or hd")
+        auto_fit: bool = Query(False, description="Wrap and size the overlay text to fill the thumbnail"),
+        quality: str = Query("hd", pattern="^(standard|hd)$", description="Image quality: standard or hd"),
+        fresh: bool = Query(False, description="Always generate a new image instead of using a pre-generated background")
 ):
     """
     Generate a thumbnail using a preset configuration.
 
     Available presets: tech, gaming, educational, lifestyle, cooking, fitness
+
+    When the preset pool is enabled (PRESET_POOL_SIZE), the overlay is drawn on a
+    pre-generated background for the preset and DALL-E is skipped, unless `fresh` is set.
+    Like /generate/thumbnail, answers with the image when `Accept` prefers image/jpeg.
+    """
+    request = preset_thumbnail_request(
+        preset,
+        title=title,
+        overlay_text=overlay_text,
+        font_size=font_size,
+        text_color=text_color,
+        stroke_color=stroke_color,
+        stroke_width=stroke_width,
+        position=position,
+        auto_fit=auto_fit,
+        quality=quality
+    )
+
+    try:
+        return await thumbnail_response(http_request, request, preset=None if fresh else preset)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def preset_thumbnail_request(preset: str, **fields: Any) -> ThumbnailRequest:
+    """
+    Build a ThumbnailRequest with a preset's style, theme and elements; fields passed
+    explicitly take precedence. 400 for unknown presets.
     """
     if preset not in THUMBNAIL_PRESETS:
         raise HTTPException(
@@ -387,21 +1893,80 @@ async def generate_thumbnail_preset(
     preset_config = THUMBNAIL_PRESETS[preset]
 
     # Create request object with preset configuration
-    request = ThumbnailRequest(
-        title=title,
-        overlay_text=overlay_text,
-        # style=preset_config["style"],
-        # theme=preset_config["theme"],
-        # additional_elements=preset_config["additional_elements"],
-        # font_size=font_size,
-        # text_color=text_color,
-        # stroke_color=stroke_color,
-        # stroke_width=stroke_width,
-        # position=position,
-        # quality=quality
-    )
+    return ThumbnailRequest(**{
+        "style": preset_config["style"],
+        "theme": preset_config["theme"],
+        "additional_elements": preset_config["additional_elements"],
+        **fields
+    })
+
+
+THUMBNAIL_BATCH_CONCURRENCY = int(os.getenv("THUMBNAIL_BATCH_CONCURRENCY", "4"))
+THUMBNAIL_BATCH_MAX_ITEMS = int(os.getenv("THUMBNAIL_BATCH_MAX_ITEMS", "100"))
+THUMBNAIL_BATCH_RETRIES = int(os.getenv("THUMBNAIL_BATCH_RETRIES", "2"))
+
+
+class BatchThumbnailItem(ThumbnailRequest):
+    preset: Optional[str] = Field(None, description="Apply a preset's configuration to this item")
+
 
-    return await generate_thumbnail(request)
+class BatchThumbnailRequest(BaseModel):
+    items: List[BatchThumbnailItem] = Field(..., min_length=1, max_length=THUMBNAIL_BATCH_MAX_ITEMS)
+    concurrency: Optional[int] = Field(None, ge=1, le=32, description="Items processed at once")
+
+
+@app.post("/generate/thumbnail/batch")
+async def generate_thumbnail_batch(request: BatchThumbnailRequest):
+    """
+    Generate thumbnails for many titles and/or presets in one call.
+
+    Items run concurrently (at most `concurrency`, default THUMBNAIL_BATCH_CONCURRENCY)
+    and every DALL-E call goes through the shared rate limiter, so a batch uses the
+    available quota without tripping 429s. Results stream back as newline-delimited
+    JSON in completion order, one line per item with its `index`, then a summary line.
+    Items that still hit a 429 (the DALL-E quota or a full image pool, both raised
+    before an image is generated) wait out its Retry-After and are retried.
+    """
+    semaphore = asyncio.Semaphore(request.concurrency or THUMBNAIL_BATCH_CONCURRENCY)
+
+    async def run(index: int, item: BatchThumbnailItem) -> Dict[str, Any]:
+        async with semaphore:
+            for attempt in range(THUMBNAIL_BATCH_RETRIES + 1):
+                try:
+                    fields = item.model_dump(exclude={"preset"}, exclude_unset=True)
+                    thumbnail = preset_thumbnail_request(item.preset, **fields) if item.preset else ThumbnailRequest(**fields)
+                    return {
+                        "index": index, "title": item.title, "ok": True,
+                        **await render_thumbnail(thumbnail, preset=item.preset)
+                    }
+                except HTTPException as e:
+                    if e.status_code == 429 and attempt < THUMBNAIL_BATCH_RETRIES:
+                        await asyncio.sleep(_retry_after(e) or 1)
+                        continue
+                    return {"index": index, "title": item.title, "ok": False, "status": e.status_code, "error": e.detail}
+                except Exception as e:
+                    return {"index": index, "title": item.title, "ok": False, "status": 500, "error": str(e)}
+
+    async def lines() -> AsyncIterator[str]:
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(request.items)]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                succeeded += result["ok"]
+                yield json.dumps(result) + "\n"
+            yield json.dumps({
+                "done": True,
+                "succeeded": succeeded,
+                "failed": len(tasks) - succeeded,
+                "elapsed": round(time.perf_counter() - started, 3)
+            }) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()  # The client went away
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
 
 
 @app.get("/generate/thumbnail/url")
@@ -432,16 +1997,40 @@ async def generate_thumbnail_url(
             "generated_at": datetime.now().isoformat()
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/thumbnails/{thumbnail_id}")
+async def get_stored_thumbnail(thumbnail_id: str, request: Request):
+    """
+    Serve a processed thumbnail by ID.
+    IDs are content hashes, so the ETag never changes and responses are cacheable forever.
+    Supports If-None-Match (304) and byte ranges.
+    """
+    found = thumbnail_store.find(thumbnail_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    path, media_type = found
+
+    etag = f'"{thumbnail_id}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
 # Error handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     return JSONResponse(
         status_code=exc.status_code,
-        content={"error": exc.detail, "timestamp": datetime.now().isoformat()}
+        content={"error": exc.detail, "timestamp": datetime.now().isoformat()},
+        headers=exc.headers
     )
 
 
@@ -452,43 +2041,723 @@ async def general_exception_handler(request, exc):
         content={"error": "Internal server error", "timestamp": datetime.now().isoformat()}
     )
 
-# Global variable for user prompt context (thread-unsafe, meant for illustration)
-USER_PROMPT: Optional[str] = None
+PROMPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "system_prompts.yml")
+
+
+class PromptRegistry:
+    """
+    System prompts from a YAML file, parsed once and kept in memory.
+    The file is re-read only when its mtime changes, so edits are picked up without a restart.
+    """
+
+    def __init__(self, filepath: str = PROMPTS_PATH):
+        self.filepath = filepath
+        self._mtime: Optional[int] = None
+        self._prompts: Dict[str, str] = {}
+
+    def load(self) -> None:
+        """(Re)load the prompt file if it changed since the last load."""
+        try:
+            mtime = os.stat(self.filepath).st_mtime_ns
+        except FileNotFoundError:
+            return  # Keep serving the last good copy
+        if mtime == self._mtime:
+            return
+        with open(self.filepath, "r") as file:
+            self._prompts = yaml.safe_load(file) or {}
+        self._mtime = mtime
+
+    def get(self, prompt_name: str, default: str = "") -> str:
+        self.load()
+        return self._prompts.get(prompt_name, default)
+
 
-def load_prompt(prompt_name: str, filepath: str = "backend/system_prompts.yml") -> str:
-    """Load a prompt from a YAML file."""
-    with open(filepath, "r") as file:
-        prompts = yaml.safe_load(file)
-        return prompts.get(prompt_name, "")
+prompt_registry = PromptRegistry()
+prompt_registry.load()
+
+def load_prompt(prompt_name: str) -> str:
+    """Look up a system prompt by name."""
+    return prompt_registry.get(prompt_name)
 
 class GenerateRequest(BaseModel):
     query: str
     format: Optional[str] = "social_post"  # Specify output ("social_post", "youtube_script", etc.)
+    use_cache: bool = True  # Set to False to skip the response cache for this request
+
 
-def generate_search_query_from_user_input(user_prompt: str) -> str:
+class PipelineContext:
     """
-    Use Gemini to generate a Tavily search query given a user prompt.
+    State of one content generation run: the request's query and format, every
+    stage's intermediate result and how long each stage took. Each request gets its
+    own instance and every stage reads from and writes to it, so concurrent requests
+    in one process never see each other's data.
     """
-    prompt = (
-        "Given the following user prompt, generate a concise search query compatible with Tavily search API. "
-        "Only output the search query text.\n\n"
-        f"User prompt: {user_prompt}"
+
+    def __init__(self, query: str, output_format: Optional[str] = "social_post", use_cache: bool = True):
+        self.query = query
+        self.format = output_format or "social_post"
+        self.use_cache = use_cache
+        self.search_query: Optional[str] = None
+        self.search_urls: List[str] = []
+        self.expanded_urls: List[str] = []
+        self.filtered_urls: List[str] = []
+        self.crawled: List[Dict[str, Any]] = []
+        self.result: Optional[str] = None
+        self.semantic_hit: Optional[Dict[str, Any]] = None
+        self.timings: Dict[str, float] = {}
+
+    @classmethod
+    def from_request(cls, request: GenerateRequest) -> "PipelineContext":
+        return cls(request.query, request.format, request.use_cache)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a pipeline stage into this run's timings (and the stage metrics)."""
+        started = time.perf_counter()
+        try:
+            with stage_timer(f"pipeline_{name}"):
+                yield
+        finally:
+            self.timings[name] = time.perf_counter() - started
+
+
+class LRUCache:
+    """In-process cache with a size limit; least recently used entries are evicted first."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def flush(self) -> None:
+        pass  # Nothing is queued
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    On-disk cache backed by SQLite so entries survive restarts. Values must be JSON-serializable.
+    Reads run on a worker thread. Writes, access-time updates and expiry deletes are queued
+    and committed by a single writer in batches every `flush_interval` seconds, so the event
+    loop never waits on a commit; queued values are served from memory until written.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, flush_interval: float = 1.0):
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        self._lock = threading.Lock()  # One connection, used from worker threads
+        self._pending: Dict[str, Tuple[Any, float, float]] = {}  # key -> (value, expires_at, set_at), not yet written
+        self._writing: Dict[str, Tuple[Any, float, float]] = {}  # The batch being committed
+        self._touched: Dict[str, float] = {}  # key -> accessed_at
+        self._expired: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def _read(self, key: str) -> Optional[Tuple[Any, float, float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)).fetchone()
+        return None if row is None else (json.loads(row[0]), row[1], row[2])
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._pending.get(key) or self._writing.get(key) or await asyncio.to_thread(self._read, key)
+        if entry is None:
+            return None
+        value, expires_at, _ = entry
+        now = time.time()
+        if expires_at < now:
+            self._expired.add(key)
+        else:
+            self._touched[key] = now
+        self._schedule_flush()
+        return value if expires_at >= now else None
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        self._pending[key] = (value, now + ttl, now)
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)  # Let a batch collect
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Commit everything queued so far."""
+        async with self._flush_lock:
+            while self._pending or self._touched or self._expired:
+                self._writing, self._pending = self._pending, {}
+                touched, self._touched = self._touched, {}
+                expired, self._expired = self._expired, set()
+                try:
+                    await asyncio.to_thread(self._write, self._writing, touched, expired)
+                except Exception as e:
+                    print(f"Response cache: writing {len(self._writing)} entries to SQLite failed ({e})")
+                finally:
+                    self._writing = {}
+
+    def _write(self, pending: Dict[str, Tuple[Any, float, float]], touched: Dict[str, float], expired: set) -> None:
+        now = time.time()
+        rows = [
+            (key, json.dumps(value), expires_at, touched.get(key, set_at))
+            for key, (value, expires_at, set_at) in pending.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in touched.items() if key not in pending]
+            )
+            # Only still-expired rows: the key may have been set again since it was read
+            self._conn.executemany(
+                "DELETE FROM cache WHERE key = ? AND expires_at < ?", [(key, now) for key in expired]
+            )
+            if rows:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN ("
+                    "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+            self._count = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def __len__(self) -> int:
+        """Rows as of the last batch written; never touches the database from the event loop."""
+        return self._count
+
+
+def _normalize_cache_part(part: Any) -> Any:
+    """Normalize a cache key component so trivially different inputs share an entry."""
+    if isinstance(part, str):
+        text = part.strip()
+        if text.lower().startswith(("http://", "https://")):
+            # Scheme and host are case-insensitive; paths are not
+            scheme, _, rest = text.partition("://")
+            host, slash, path = rest.partition("/")
+            return f"{scheme.lower()}://{host.lower()}{slash}{path.split('#')[0]}".rstrip("/")
+        return " ".join(text.split()).lower()
+    if isinstance(part, (list, tuple)):
+        return [_normalize_cache_part(p) for p in part]
+    return part
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for upstream API responses.
+    Keys are a hash of the stage name plus its normalized inputs; each stage has its own TTL.
+    """
+
+    def __init__(self, backend, ttls: Dict[str, float]):
+        self.backend = backend
+        self.ttls = ttls
+        self.hits: Dict[str, int] = {stage: 0 for stage in ttls}
+        self.misses: Dict[str, int] = {stage: 0 for stage in ttls}
+
+    @staticmethod
+    def make_key(stage: str, parts: List[Any]) -> str:
+        payload = json.dumps([stage, _normalize_cache_part(parts)], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get_or_set(
+            self,
+            stage: str,
+            parts: List[Any],
+            factory: Callable[[], Awaitable[Any]],
+            use_cache: bool = True
+    ) -> Any:
+        """Return the cached value for (stage, parts), or await `factory()` and cache its result."""
+        if not use_cache:
+            return await factory()
+        value = await self.get(stage, parts)
+        if value is None:
+            value = await factory()
+            await self.set(stage, parts, value)
+        return value
+
+    async def get(self, stage: str, parts: List[Any]) -> Optional[Any]:
+        """Look up a cached value directly, counting the hit or miss."""
+        value = await self.backend.get(self.make_key(stage, parts))
+        counter = self.misses if value is None else self.hits
+        counter[stage] = counter.get(stage, 0) + 1
+        return value
+
+    async def set(self, stage: str, parts: List[Any], value: Any) -> None:
+        if value is not None:
+            await self.backend.set(self.make_key(stage, parts), value, self.ttls.get(stage, 300))
+
+    async def flush(self) -> None:
+        """Write out anything the backend still has queued; called on shutdown."""
+        await self.backend.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "stages": {
+                stage: {"hits": self.hits.get(stage, 0), "misses": self.misses.get(stage, 0), "ttl": ttl}
+                for stage, ttl in self.ttls.items()
+            }
+        }
+
+
+# Per-stage TTLs in seconds; override with e.g. CACHE_TTL_TAVILY_SITEMAP=3600
+CACHE_TTLS = {
+    stage: float(os.getenv(f"CACHE_TTL_{stage.upper()}", default))
+    for stage, default in {
+        "search_query": 3600,
+        "tavily_search": 3600,
+        "tavily_sitemap": 6 * 3600,
+        "gemini_filter": 1800,
+        "tavily_crawl": 3600,
+        "generated_content": 600,
+    }.items()
+}
+
+if os.getenv("CACHE_BACKEND", "memory") == "sqlite":
+    _cache_backend = SQLiteCache(
+        os.getenv("CACHE_SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "responses.sqlite3")),
+        max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
     )
-    response = gemini_client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt,
-        config=GenerateContentConfig(
-            system_instruction=[load_prompt("gemini_search")]
+else:
+    _cache_backend = LRUCache(max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")))
+
+response_cache = ResponseCache(_cache_backend, CACHE_TTLS)
+
+
+# Common shorthand mapped to one spelling so it lands in the same hash buckets
+_QUERY_ALIASES = {
+    "mic": "microphone", "mics": "microphone", "cam": "camera", "cams": "camera", "vid": "video", "vids": "video",
+    "yt": "youtube", "youtuber": "youtube", "youtubers": "youtube", "ig": "instagram", "insta": "instagram",
+    "cheap": "budget", "affordable": "budget", "inexpensive": "budget", "pc": "computer", "laptop": "computer",
+    "without": "no"
+}
+_QUERY_STOPWORDS = {
+    "a", "an", "the", "for", "of", "to", "in", "on", "and", "or", "with", "how", "what", "which", "is", "are",
+    "my", "your", "me", "i", "best", "top", "good", "great",
+    # Every query comes from a YouTube creator, so naming the platform narrows nothing
+    "youtube"
+}
+# Words that say what kind of answer is wanted without narrowing the topic: the only
+# content words allowed to differ between matched queries (after plural folding)
+_QUERY_QUALIFIERS = {
+    "tip", "trick", "guide", "tutorial", "review", "idea", "advice", "example", "overview",
+    "explained", "recommendation"
+}
+
+
+class SemanticCache:
+    """
+    Cache of finished content runs looked up by query similarity rather than exact key,
+    so rephrasings of an earlier query ("best budget mics 2026" / "budget microphones 2026")
+    skip the upstream stages.
+
+    Queries are embedded with a hashing vectorizer (words, word pairs and character
+    trigrams hashed into `dim` signed buckets, L2-normalized) and kept in one NumPy
+    matrix per output format; a lookup is a single matrix-vector product. A match at
+    or above `result_threshold` returns the cached text while it is younger than
+    `result_ttl`; one at or above `reuse_threshold` reuses the search, sitemap, filter
+    and crawl results and only regenerates the text. Entries older than `max_age` are
+    dropped, and the oldest go first once a format holds `max_entries`.
+
+    Similarity alone confuses neighbouring topics ("keto meal prep" / "vegan meal prep"),
+    narrower ones ("budget gaming pc build" / "gaming pc build") and opposite ones
+    ("worth it" / "not worth it"), so a candidate also has to pass a content-word check:
+    see `compatible`.
+    """
+
+    REUSED_FIELDS = ("search_query", "search_urls", "expanded_urls", "filtered_urls", "crawled")
+
+    def __init__(
+            self,
+            dim: int = 1024,
+            result_threshold: float = 0.92,
+            reuse_threshold: float = 0.8,
+            result_ttl: float = 600,
+            max_age: float = 3600,
+            max_entries: int = 512
+    ):
+        self.dim = dim
+        self.result_threshold = result_threshold
+        self.reuse_threshold = reuse_threshold
+        self.result_ttl = result_ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        # format -> (vectors matrix, entries in insertion order)
+        self._indexes: Dict[str, Tuple[np.ndarray, List[Dict[str, Any]]]] = {}
+        self.counts = {"result": 0, "intermediates": 0, "miss": 0}
+        self.evicted = 0
+
+    @staticmethod
+    def terms(text: str) -> List[str]:
+        """Content words of a query: aliases applied, stopwords dropped, plurals folded."""
+        words = [_QUERY_ALIASES.get(word, word) for word in re.findall(r"[a-z0-9]+", text.lower())]
+        return [
+            word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+            for word in words if word not in _QUERY_STOPWORDS
+        ]
+
+    @staticmethod
+    def compatible(first: List[str], second: List[str]) -> bool:
+        """
+        Whether two queries' content words describe the same topic. Words match when equal
+        or when they share a stem (grow / growing). Words without a match on the other side
+        must all be known non-topical qualifiers (tips, guide, review...), or the current
+        year, which a query without a year means anyway. Any other extra word narrows or
+        changes the topic (budget, kids, 2025, not), whichever side has it.
+        """
+        def matches(word: str, others: List[str]) -> bool:
+            return any(
+                word == other or (min(len(word), len(other)) >= 4 and (word.startswith(other) or other.startswith(word)))
+                for other in others
+            )
+
+        unmatched = [word for word in first if not matches(word, second)]
+        unmatched += [word for word in second if not matches(word, first)]
+        current_year = str(datetime.now().year)
+        return all(word in _QUERY_QUALIFIERS or word == current_year for word in unmatched)
+
+    def embed(self, text: str) -> np.ndarray:
+        words = self.terms(text)
+        features = [(word, 1.0) for word in words]
+        features += [(f"{first} {second}", 0.7) for first, second in zip(words, words[1:])]
+        features += [(f"#{padded[i:i + 3]}", 0.3) for word in words for padded in [f" {word} "] for i in range(len(word))]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in features:
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[h % self.dim] += weight if h >> 63 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict(self, output_format: str) -> None:
+        if output_format not in self._indexes:
+            return
+        vectors, entries = self._indexes[output_format]
+        cutoff = time.time() - self.max_age
+        # Entries are in insertion order, so expired ones form a prefix
+        keep = next((i for i, entry in enumerate(entries) if entry["created_at"] >= cutoff), len(entries))
+        keep = max(keep, len(entries) - self.max_entries)
+        if keep:
+            self.evicted += keep
+            self._indexes[output_format] = (vectors[keep:], entries[keep:])
+
+    def lookup(self, query: str, output_format: str) -> Tuple[Optional[str], float, Optional[Dict[str, Any]]]:
+        """Return (hit kind or None, similarity, entry) for the closest compatible earlier query in this format."""
+        self._evict(output_format)
+        vectors, entries = self._indexes.get(output_format, (None, []))
+        if not entries:
+            self.counts["miss"] += 1
+            return None, 0.0, None
+        similarities = vectors @ self.embed(query)
+        terms = self.terms(query)
+        # The closest candidate that passes the content-word check
+        for index in np.argsort(-similarities):
+            similarity, entry = float(similarities[index]), entries[index]
+            if similarity < self.reuse_threshold:
+                break
+            if not self.compatible(terms, entry["terms"]):
+                continue
+            kind = "result" if similarity >= self.result_threshold and \
+                time.time() - entry["created_at"] < self.result_ttl else "intermediates"
+            self.counts[kind] += 1
+            return kind, similarity, entry
+        self.counts["miss"] += 1
+        return None, 0.0, None
+
+    def restore(self, ctx: PipelineContext) -> Optional[str]:
+        """Fill `ctx` from the closest cached run, if close enough; returns the hit kind."""
+        kind, similarity, entry = self.lookup(ctx.query, ctx.format)
+        if kind is None:
+            return None
+        for field in self.REUSED_FIELDS:
+            setattr(ctx, field, entry[field])
+        if kind == "result":
+            ctx.result = entry["result"]
+        ctx.semantic_hit = {"kind": kind, "similarity": round(similarity, 4), "query": entry["query"]}
+        return kind
+
+    def add(self, ctx: PipelineContext) -> None:
+        """Remember a finished run; a near-identical earlier query is replaced."""
+        if not ctx.crawled or not ctx.result:
+            return
+        self._evict(ctx.format)
+        vector = self.embed(ctx.query)
+        vectors, entries = self._indexes.get(ctx.format, (np.empty((0, self.dim), dtype=np.float32), []))
+        if entries:
+            duplicates = set(np.flatnonzero(vectors @ vector >= 0.999).tolist())
+            if duplicates:
+                vectors = np.delete(vectors, sorted(duplicates), axis=0)
+                entries = [entry for i, entry in enumerate(entries) if i not in duplicates]
+        entry = {field: getattr(ctx, field) for field in self.REUSED_FIELDS}
+        entry.update(query=ctx.query, terms=self.terms(ctx.query), result=ctx.result, created_at=time.time())
+        self._indexes[ctx.format] = (np.vstack([vectors, vector[None, :]]), entries + [entry])
+        self._evict(ctx.format)
+
+    def hit_rate(self) -> float:
+        lookups = sum(self.counts.values())
+        return (self.counts["result"] + self.counts["intermediates"]) / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "hit_rate": round(self.hit_rate(), 4),
+            "evicted": self.evicted,
+            "entries": {output_format: len(entries) for output_format, (_, entries) in self._indexes.items()},
+            "result_threshold": self.result_threshold,
+            "reuse_threshold": self.reuse_threshold
+        }
+
+
+semantic_cache = SemanticCache(
+    dim=int(os.getenv("SEMANTIC_CACHE_DIM", "1024")),
+    result_threshold=float(os.getenv("SEMANTIC_CACHE_RESULT_THRESHOLD", "0.92")),
+    reuse_threshold=float(os.getenv("SEMANTIC_CACHE_REUSE_THRESHOLD", "0.8")),
+    result_ttl=CACHE_TTLS["generated_content"],
+    max_age=float(os.getenv("SEMANTIC_CACHE_MAX_AGE", "3600")),
+    max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the upstream response cache and the semantic content cache."""
+    return {**response_cache.stats(), "semantic": semantic_cache.stats()}
+
+async def gather_bounded(
+        calls: List[Callable[[], Awaitable[Any]]],
+        limit: int = TAVILY_CONCURRENCY,
+        timeout: Optional[float] = None,
+        on_done: Optional[Callable[[int, Any], None]] = None
+) -> List[Any]:
+    """
+    Run coroutine factories concurrently, at most `limit` at a time.
+    Each call gets its own `timeout`, if given. Failures are returned in place of
+    results (like `return_exceptions=True`) so callers can keep partial results.
+    `on_done(index, result_or_exception)` is called as each call finishes.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(index: int, call: Callable[[], Awaitable[Any]]) -> Any:
+        async with semaphore:
+            try:
+                result = await (asyncio.wait_for(call(), timeout) if timeout else call())
+            except Exception as e:
+                result = e
+        if on_done is not None:
+            on_done(index, result)
+        return result
+
+    return await asyncio.gather(*(run(index, call) for index, call in enumerate(calls)), return_exceptions=True)
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# Prompt token budgets per Gemini stage; override with e.g. PROMPT_BUDGET_GEMINI_FILTER=8000
+PROMPT_BUDGETS = {
+    stage: int(os.getenv(f"PROMPT_BUDGET_{stage.upper()}", default))
+    for stage, default in {"search_query": 1000, "gemini_filter": 4000, "generated_content": 6000}.items()
+}
+
+# Static system instructions are uploaded once as Gemini cached content and referenced by name
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+class PromptBuilder:
+    """
+    Assemble a prompt from sections and keep it within a token budget.
+    When the estimate is over budget, trimmable sections are cut from the end,
+    lowest priority first, preferring to cut at their separator.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.trimmed_tokens = 0
+        self._sections: List[Dict[str, Any]] = []
+
+    def add(self, text: str, priority: int = 0, trimmable: bool = False, separator: str = "\n") -> "PromptBuilder":
+        self._sections.append({"text": text, "priority": priority, "trimmable": trimmable, "separator": separator})
+        return self
+
+    def build(self) -> str:
+        excess = sum(estimate_tokens(section["text"]) for section in self._sections) - self.budget
+        for section in sorted((s for s in self._sections if s["trimmable"]), key=lambda s: s["priority"]):
+            if excess <= 0:
+                break
+            size = estimate_tokens(section["text"])
+            text = section["text"][:max(0, size - excess) * 4]
+            if text and section["separator"] in text:
+                text = text.rsplit(section["separator"], 1)[0]
+            removed = size - estimate_tokens(text)
+            section["text"] = text
+            excess -= removed
+            self.trimmed_tokens += removed
+        return "".join(section["text"] for section in self._sections)
+
+
+class GeminiUsage:
+    """Per-stage counters for Gemini calls: estimated and reported tokens, and latency."""
+
+    FIELDS = ("calls", "estimated_prompt_tokens", "prompt_tokens", "cached_tokens", "response_tokens",
+              "trimmed_tokens", "latency_seconds")
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def record(self, stage: str, estimated: int, trimmed: int, latency: float, usage: Any = None) -> None:
+        totals = self.stages.setdefault(stage, dict.fromkeys(self.FIELDS, 0))
+        totals["calls"] += 1
+        totals["estimated_prompt_tokens"] += estimated
+        totals["trimmed_tokens"] += trimmed
+        totals["latency_seconds"] += latency
+        if usage is not None:
+            totals["prompt_tokens"] += getattr(usage, "prompt_token_count", None) or 0
+            totals["cached_tokens"] += getattr(usage, "cached_content_token_count", None) or 0
+            totals["response_tokens"] += getattr(usage, "candidates_token_count", None) or 0
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage: {**totals, "avg_latency_seconds": totals["latency_seconds"] / totals["calls"]}
+            for stage, totals in self.stages.items()
+        }
+
+
+gemini_usage = GeminiUsage()
+_context_caches: Dict[str, Dict[str, Any]] = {}
+_context_cache_lock = asyncio.Lock()
+
+
+async def gemini_config(system_prompt_name: Optional[str]) -> Optional["GenerateContentConfig"]:
+    """
+    Config carrying the named system instruction. When context caching is on, the
+    instruction is created once as cached content (re-created when the prompt file
+    changes or the cache nears expiry); otherwise, or if caching fails, it is sent inline.
+    """
+    if system_prompt_name is None:
+        return None
+    from google.genai.types import GenerateContentConfig, CreateCachedContentConfig
+    instruction = load_prompt(system_prompt_name)
+    if GEMINI_CONTEXT_CACHE:
+        digest = hashlib.sha256(instruction.encode("utf-8")).hexdigest()
+        async with _context_cache_lock:
+            entry = _context_caches.get(system_prompt_name)
+            stale = entry is None or entry["digest"] != digest or \
+                (entry["name"] is not None and entry["expires_at"] < time.time() + 60)
+            if stale:
+                entry = {"digest": digest, "name": None, "expires_at": time.time() + GEMINI_CONTEXT_CACHE_TTL}
+                try:
+                    cache = await get_gemini_client().aio.caches.create(
+                        model=GEMINI_MODEL,
+                        config=CreateCachedContentConfig(
+                            system_instruction=instruction,
+                            ttl=f"{GEMINI_CONTEXT_CACHE_TTL}s",
+                            display_name=f"creatorcompass-{system_prompt_name}"
+                        )
+                    )
+                    entry["name"] = cache.name
+                except Exception as e:
+                    # e.g. the instruction is under the model's minimum cacheable size
+                    print(f"Context caching unavailable for {system_prompt_name}, sending inline: {e}")
+                _context_caches[system_prompt_name] = entry
+        if entry["name"] is not None:
+            return GenerateContentConfig(cached_content=entry["name"])
+    return GenerateContentConfig(system_instruction=[instruction])
+
+
+async def gemini_generate(stage: str, prompt: PromptBuilder, system_prompt_name: Optional[str] = None) -> str:
+    """Send a budgeted prompt to Gemini and record its token counts and latency under `stage`."""
+    contents = prompt.build()
+    config = await gemini_config(system_prompt_name)
+    started = time.perf_counter()
+    response = await upstreams["gemini"].call(
+        stage if stage.startswith("gemini_") else f"gemini_{stage}",
+        lambda: get_gemini_client().aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=contents,
+            config=config
         )
     )
+    gemini_usage.record(
+        stage, estimate_tokens(contents), prompt.trimmed_tokens,
+        time.perf_counter() - started, getattr(response, "usage_metadata", None)
+    )
     return response.text.strip()
 
-def tavily_search(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
+
+@app.get("/upstreams/stats")
+async def upstream_stats():
+    """Rate limit, retry, hedging and circuit breaker state per upstream provider."""
+    return {name: upstream.stats() for name, upstream in upstreams.items()}
+
+
+@app.get("/gemini/stats")
+async def gemini_stats():
+    """Prompt/response token counts and latency per Gemini stage."""
+    return gemini_usage.stats()
+
+
+async def generate_search_query_from_user_input(user_prompt: str, use_cache: bool = True) -> str:
+    """
+    Use Gemini to generate a Tavily search query given a user prompt.
+    """
+    prompt = PromptBuilder(PROMPT_BUDGETS["search_query"]).add(
+        "Given the following user prompt, generate a concise search query compatible with Tavily search API. "
+        "Only output the search query text.\n\n"
+    ).add(f"User prompt: {user_prompt}", trimmable=True, separator=" ")
+
+    return await response_cache.get_or_set(
+        "search_query", [user_prompt],
+        lambda: gemini_generate("search_query", prompt, system_prompt_name="gemini_search"),
+        use_cache
+    )
+
+async def tavily_search(query: str, max_results: int = 5, use_cache: bool = True) -> List[Dict[str, Any]]:
     """
     Search Tavily for relevant URLs.
     """
     try:
-        results = tavily_client.search(query=query, search_depth="advanced", max_results=max_results)
+        results = await response_cache.get_or_set(
+            "tavily_search",
+            [query, max_results],
+            lambda: upstreams["tavily"].call("tavily_search", lambda: get_tavily_client().search(
+                query=query, search_depth="advanced", max_results=max_results
+            )),
+            use_cache
+        )
         # Expect results to have a 'results' or 'links' key
         urls = []
         if isinstance(results, dict):
@@ -501,43 +2770,123 @@ def tavily_search(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
         elif isinstance(results, list):
             urls = [r.get("url", r) if isinstance(r, dict) else r for r in results]
         return urls[:max_results]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Tavily search error: {e}")
 
-def tavily_sitemap(urls: List[str]) -> List[str]:
+async def tavily_sitemap(urls: List[str], use_cache: bool = True) -> List[str]:
     """
     Expand a list of URLs into their sitemaps using Tavily.
+    The per-URL map calls run concurrently. A URL whose map call still fails after
+    retries is logged and kept as-is, so the search result itself stays a candidate.
     Returns a flat list of discovered URLs.
     """
+    results = await gather_bounded(
+        [
+            lambda url=url: response_cache.get_or_set(
+                "tavily_sitemap", [url],
+                lambda: upstreams["tavily"].call(
+                    "tavily_map", lambda: get_tavily_client().map(url=url), timeout=TAVILY_MAP_TIMEOUT
+                ),
+                use_cache
+            )
+            for url in urls
+        ],
+        timeout=upstreams["tavily"].budget(TAVILY_MAP_TIMEOUT)
+    )
     sitemap_urls = []
-    for url in urls:
-        try:
-            result = tavily_client.map(url=url)
-            if 'urls' in result:
-                sitemap_urls.extend(result['urls'])
-            elif isinstance(result, list):
-                sitemap_urls.extend(result)
-        except Exception:
+    for url, result in zip(urls, results):
+        if isinstance(result, BaseException):
+            print(f"Tavily map failed for {url}, using the page itself: {type(result).__name__}: {result}")
+            sitemap_urls.append(url)
             continue
+        if isinstance(result, dict) and 'urls' in result:
+            sitemap_urls.extend(result['urls'])
+        elif isinstance(result, dict) and isinstance(result.get('results'), list):
+            sitemap_urls.extend(result['results'])  # The map API's documented response shape
+        elif isinstance(result, list):
+            sitemap_urls.extend(result)
     return sitemap_urls
 
-def gemini_filter_urls_via_prompt(user_prompt: str, sitemap_urls: List[str]) -> List[str]:
+# How many locally ranked sitemap URLs are sent to the Gemini filter
+SITEMAP_PREFILTER_TOP_N = int(os.getenv("SITEMAP_PREFILTER_TOP_N", "50"))
+
+# Assets, taxonomy/archive listings and account pages never make good sources
+_EXCLUDED_URL_RE = re.compile(
+    r"\.(jpe?g|png|gif|svg|webp|avif|ico|css|js|pdf|zip|xml|json|rss|mp4|mp3|woff2?)$|"
+    r"/(tags?|categor(y|ies)|authors?|archives?|feed|wp-json|wp-content|wp-admin|login|"
+    r"signin|signup|register|account|cart|checkout|search)(/|$)",
+    re.IGNORECASE
+)
+_PAGINATION_RE = re.compile(r"/page/\d+$", re.IGNORECASE)
+# Host and path of an absolute URL; much cheaper than urlsplit over 100k-URL sitemaps
+_URL_HOST_PATH_RE = re.compile(r"^(?:[a-zA-Z][a-zA-Z0-9+.-]*:)?//([^/?#]*)([^?#]*)")
+
+
+def prefilter_sitemap_urls(user_prompt: str, sitemap_urls: List[str], top_n: Optional[int] = None) -> List[str]:
+    """
+    Rank sitemap URLs against the user prompt locally and keep the best `top_n`
+    (default SITEMAP_PREFILTER_TOP_N). Query-string, fragment, trailing-slash and
+    pagination variants of a page are collapsed and asset/tag/archive paths dropped.
+    Path words are scored by TF-IDF across the sitemap, with matches in the last
+    path segment (usually the slug) counting double.
+    """
+    top_n = SITEMAP_PREFILTER_TOP_N if top_n is None else top_n
+    terms = set(_tokenize(user_prompt))
+    # Map raw path words (including plural forms) straight to query terms
+    lookup = {**{f"{term}s": term for term in terms}, **{term: term for term in terms}}
+    candidates: Dict[str, Tuple[str, set, set, int]] = {}
+    for url in sitemap_urls:
+        if not isinstance(url, str):
+            continue
+        match = _URL_HOST_PATH_RE.match(url.strip())
+        if match is None:
+            continue
+        path = _PAGINATION_RE.sub("", match.group(2).rstrip("/"))
+        canonical = f"{match.group(1).lower()}{path}"
+        if canonical in candidates or _EXCLUDED_URL_RE.search(path):
+            continue
+        words = _WORD_RE.findall(path.lower())
+        matched = {lookup[word] for word in words if word in lookup}
+        slug = {lookup[word] for word in _WORD_RE.findall(path.rsplit("/", 1)[-1].lower()) if word in lookup} \
+            if matched else set()
+        candidates[canonical] = (url, matched, slug, len(words))
+
+    if len(candidates) <= top_n or not terms:
+        return [url for url, _, _, _ in candidates.values()][:top_n]
+
+    document_frequency = Counter(term for _, matched, _, _ in candidates.values() for term in matched)
+    idf = {term: math.log(len(candidates) / (1 + df)) + 1 for term, df in document_frequency.items()}
+
+    def score(entry: Tuple[str, set, set, int]) -> Tuple[float, int]:
+        _, matched, slug, length = entry
+        relevance = sum(idf[term] * (2 if term in slug else 1) for term in matched)
+        return relevance, -length  # Prefer shorter paths on ties
+
+    ranked = heapq.nlargest(top_n, candidates.values(), key=score)
+    return [url for url, _, _, _ in ranked]
+
+
+async def gemini_filter_urls_via_prompt(user_prompt: str, sitemap_urls: List[str], use_cache: bool = True) -> List[str]:
     """
     Filter relevant URLs from the sitemap using the initial user prompt as context.
+    The sitemap is first narrowed locally so the prompt stays small for large sites.
     """
-    filter_prompt = (
+    sitemap_urls = await asyncio.to_thread(prefilter_sitemap_urls, user_prompt, sitemap_urls)
+    filter_prompt = PromptBuilder(PROMPT_BUDGETS["gemini_filter"]).add(
         "Given the list of sitemap URLs below and the user's content creation intent, "
         "select and return as a JSON array the 5 most relevant URLs for content creation."
         "\n\nUser's intent:\n"
-        f"{user_prompt}\n\n"
+    ).add(f"{user_prompt}\n\n", priority=1, trimmable=True, separator=" ").add(
         "Sitemap URLs:\n"
-        + "\n".join(sitemap_urls)
-    )
-    response = gemini_client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=filter_prompt
+    ).add("\n".join(sitemap_urls), trimmable=True)  # Ranked best first, so trimming drops the weakest
+
+    output = await response_cache.get_or_set(
+        "gemini_filter", [user_prompt, sitemap_urls],
+        lambda: gemini_generate("gemini_filter", filter_prompt),
+        use_cache
     )
-    output = response.text.strip()
     try:
         if output.startswith("```json"):
             output = output.strip("`").replace("json", "", 1).strip()
@@ -550,25 +2899,187 @@ def gemini_filter_urls_via_prompt(user_prompt: str, sitemap_urls: List[str]) ->
         pass
     return sitemap_urls[:5]  # Fallback: return the top 5
 
-def tavily_crawl(urls: List[str]) -> List[Dict[str, Any]]:
+def _crawled_item(url: str, result: Any) -> Dict[str, Any]:
+    if isinstance(result, BaseException):
+        return {"url": url, "content": "", "error": str(result) or type(result).__name__}
+    content = result.get("content", "")
+    if not content and isinstance(result.get("results"), list):
+        # Crawl responses carry one raw_content per page visited under the base URL
+        content = "\n\n".join(page.get("raw_content") or "" for page in result["results"] if isinstance(page, dict))
+    return {"url": url, "content": content}
+
+
+# Token budget for web content in the final generation prompt
+CONTENT_TOKEN_BUDGET = int(os.getenv("CONTENT_TOKEN_BUDGET", "3000"))
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i in is it its of on or our so that the their this "
+    "to was we were what when which who why will with you your".split()
+)
+# Lines that are navigation, cookie banners, footers and similar page chrome. Only short
+# lines are tested: creators' articles use words like "subscribe" in real sentences
+_BOILERPLATE_MAX_WORDS = 8
+_BOILERPLATE_RE = re.compile(
+    r"cookie|privacy policy|terms of (use|service)|all rights reserved|subscribe|sign (in|up)|log ?in|"
+    r"newsletter|skip to (main )?content|share (this|on)|follow us|related posts|advertisement|©",
+    re.IGNORECASE
+)
+
+
+def _tokenize(text: str) -> List[str]:
+    """Lowercase words without stopwords, with plural "s" stripped so "microphones" matches "microphone"."""
+    return [
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in _WORD_RE.findall(text.lower()) if word not in _STOPWORDS
+    ]
+
+
+def _simhash(tokens: List[str]) -> int:
+    """64-bit SimHash over word trigrams; near-identical texts differ in only a few bits."""
+    weights = [0] * 64
+    shingles = [" ".join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))]
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+class ContentStore:
+    """
+    Crawled page text, cleaned and split into chunks for prompt building.
+    Pages are stripped of boilerplate lines, chunked by paragraph, near-duplicate
+    chunks are dropped via SimHash, and chunks are ranked against a query with BM25.
+    """
+
+    def __init__(self, chunk_words: int = 120, max_distance: int = 3):
+        self.chunk_words = chunk_words
+        self.max_distance = max_distance
+        self.chunks: List[Dict[str, Any]] = []
+        self.duplicates = 0
+        # SimHash split into 4 bands of 16 bits: texts within 3 bits share at least one band
+        self._bands: Dict[Tuple[int, int], List[int]] = {}
+
+    @staticmethod
+    def extract_text(raw: str) -> List[str]:
+        """Return the content paragraphs of a page, without navigation and other boilerplate."""
+        paragraphs, current = [], []
+        seen_lines = set()
+        for line in raw.splitlines():
+            line = " ".join(line.replace("#", " ").replace("*", " ").split())
+            if not line:
+                if current:
+                    paragraphs.append(" ".join(current))
+                    current = []
+                continue
+            words = line.split()
+            # Short lines without sentence punctuation are menus, buttons and breadcrumbs
+            is_fragment = len(words) < 4 and not line.endswith((".", "!", "?", ":"))
+            is_chrome = len(words) <= _BOILERPLATE_MAX_WORDS and _BOILERPLATE_RE.search(line)
+            if is_fragment or is_chrome or line.lower() in seen_lines:
+                continue
+            seen_lines.add(line.lower())
+            current.append(line)
+        if current:
+            paragraphs.append(" ".join(current))
+        return paragraphs
+
+    def add(self, url: str, raw: str) -> None:
+        """Clean, chunk and index a page's content."""
+        chunk: List[str] = []
+        for paragraph in self.extract_text(raw):
+            chunk.extend(paragraph.split())
+            if len(chunk) >= self.chunk_words:
+                self._add_chunk(url, " ".join(chunk))
+                chunk = []
+        if chunk:
+            self._add_chunk(url, " ".join(chunk))
+
+    def _add_chunk(self, url: str, text: str) -> None:
+        tokens = _tokenize(text)
+        if not tokens:
+            return
+        fingerprint = _simhash(tokens)
+        bands = [(band, fingerprint >> (16 * band) & 0xFFFF) for band in range(4)]
+        for band in bands:
+            for index in self._bands.get(band, []):
+                if bin(fingerprint ^ self.chunks[index]["simhash"]).count("1") <= self.max_distance:
+                    self.duplicates += 1
+                    return
+        for band in bands:
+            self._bands.setdefault(band, []).append(len(self.chunks))
+        self.chunks.append({"url": url, "text": text, "tokens": tokens, "simhash": fingerprint})
+
+    def rank(self, query: str, k1: float = 1.5, b: float = 0.75) -> List[Tuple[float, Dict[str, Any]]]:
+        """Score every chunk against `query` with BM25, best first."""
+        terms = set(_tokenize(query))
+        if not self.chunks or not terms:
+            return [(0.0, chunk) for chunk in self.chunks]
+        average_length = sum(len(chunk["tokens"]) for chunk in self.chunks) / len(self.chunks)
+        frequencies = [Counter(chunk["tokens"]) for chunk in self.chunks]
+        idf = {}
+        for term in terms:
+            df = sum(1 for tf in frequencies if term in tf)
+            idf[term] = math.log(1 + (len(self.chunks) - df + 0.5) / (df + 0.5))
+        scored = []
+        for chunk, tf in zip(self.chunks, frequencies):
+            norm = k1 * (1 - b + b * len(chunk["tokens"]) / average_length)
+            score = sum(idf[t] * tf[t] * (k1 + 1) / (tf[t] + norm) for t in terms if t in tf)
+            scored.append((score, chunk))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return scored
+
+    def select(self, query: str, token_budget: int) -> List[Dict[str, Any]]:
+        """The highest-ranked chunks that fit in `token_budget`, in rank order."""
+        selected, used = [], 0
+        for _, chunk in self.rank(query):
+            cost = estimate_tokens(chunk["text"])
+            if used + cost > token_budget:
+                continue
+            selected.append(chunk)
+            used += cost
+        return selected
+
+async def tavily_crawl(
+        urls: List[str],
+        use_cache: bool = True,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> List[Dict[str, Any]]:
     """
     Crawl provided URLs using Tavily.
+    The per-URL crawl calls run concurrently; failed or timed-out URLs are kept
+    with empty content and an error message so the rest of the results survive.
+    `on_progress` receives each crawled item as soon as its URL finishes.
     """
-    crawled_data = []
-    for url in urls:
-        try:
-            result = tavily_client.crawl(url=url)
-            crawled_data.append({"url": url, "content": result.get("content", "")})
-        except Exception as e:
-            crawled_data.append({"url": url, "content": "", "error": str(e)})
-    return crawled_data
+    results = await gather_bounded(
+        [
+            # Crawls are slow and billed per attempt, so they are never hedged
+            lambda url=url: response_cache.get_or_set(
+                "tavily_crawl", [url],
+                lambda: upstreams["tavily"].call(
+                    "tavily_crawl", lambda: get_tavily_client().crawl(url=url), idempotent=False, timeout=TAVILY_CRAWL_TIMEOUT
+                ),
+                use_cache
+            )
+            for url in urls
+        ],
+        timeout=upstreams["tavily"].budget(TAVILY_CRAWL_TIMEOUT),
+        on_done=(lambda index, result: on_progress(_crawled_item(urls[index], result))) if on_progress else None
+    )
+    return [_crawled_item(url, result) for url, result in zip(urls, results)]
 
-def generate_content_with_gemini(user_prompt: str, crawled_data: List[Dict[str, Any]], output_format: str = "social_post") -> str:
+def build_content_prompt(user_prompt: str, crawled_data: List[Dict[str, Any]], output_format: str = "social_post") -> PromptBuilder:
     """
-    Generate a social post, YouTube script, or IG reel script based on the requested format.
+    Build the final generation prompt for a social post, YouTube script, or IG reel script.
+    Web content is reduced to the chunks most relevant to the request that fit CONTENT_TOKEN_BUDGET.
     """
+    store = ContentStore()
+    for item in crawled_data:
+        if item.get('content'):
+            store.add(item['url'], item['content'])
     content_snippets = "\n\n".join(
-        [f"URL: {item['url']}\nContent: {item['content'][:500]}" for item in crawled_data if item.get('content')]
+        [f"URL: {chunk['url']}\nContent: {chunk['text']}" for chunk in store.select(user_prompt, CONTENT_TOKEN_BUDGET)]
     )
     format_instruction = (
         "POST:\n<write the post here>\nSOURCE_URLS:\n- <url1>\n..." if output_format == "social_post"
@@ -576,46 +3087,743 @@ def generate_content_with_gemini(user_prompt: str, crawled_data: List[Dict[str,
         else "REEL SCRIPT:\n<write instagram reel script here>\nSOURCE_URLS:\n- <url1>\n..."
     )
 
-    prompt = (
+    return PromptBuilder(PROMPT_BUDGETS["generated_content"]).add(
         f"Based on the user's request and the following web contents, generate a {output_format.replace('_', ' ')}.\n"
         f"Format:\n\"\"\"\n{format_instruction}\n\"\"\"\n\n"
-        f"USER REQUEST:\n{user_prompt}\n\n"
-        f"WEB CONTENTS:\n{content_snippets}\n"
+        "USER REQUEST:\n"
+    ).add(f"{user_prompt}\n\n", priority=1, trimmable=True, separator=" ").add(
+        "WEB CONTENTS:\n"
+    ).add(f"{content_snippets}\n", trimmable=True, separator="\n\n").add(
         "Return only the filled out template in your response."
     )
-    response = gemini_client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt
+
+async def generate_content_with_gemini(user_prompt: str, crawled_data: List[Dict[str, Any]], output_format: str = "social_post", use_cache: bool = True) -> str:
+    """
+    Generate a social post, YouTube script, or IG reel script based on the requested format.
+    """
+    # Cleaning, SimHash and BM25 over the crawl output are CPU-bound; keep them off the event loop
+    prompt = await asyncio.to_thread(build_content_prompt, user_prompt, crawled_data, output_format)
+    return await response_cache.get_or_set(
+        "generated_content", [prompt.build()],
+        lambda: gemini_generate("generated_content", prompt),
+        use_cache
     )
-    return response.text.strip()
+
+async def stream_content_with_gemini(
+        user_prompt: str,
+        crawled_data: List[Dict[str, Any]],
+        output_format: str = "social_post",
+        use_cache: bool = True
+) -> AsyncIterator[str]:
+    """
+    Like generate_content_with_gemini, but yields text chunks as Gemini produces them.
+    A cached result is yielded as a single chunk; a completed stream is cached.
+    """
+    builder = await asyncio.to_thread(build_content_prompt, user_prompt, crawled_data, output_format)
+    prompt = builder.build()
+    if use_cache:
+        cached = await response_cache.get("generated_content", [prompt])
+        if cached is not None:
+            yield cached
+            return
+
+    chunks = []
+    usage = None
+    started = time.perf_counter()
+    with stage_timer("gemini_generated_content", upstream="gemini"):
+        # Only opening the stream is retried; chunks already sent to the client cannot be taken back
+        stream = await upstreams["gemini"].call(
+            None,
+            lambda: get_gemini_client().aio.models.generate_content_stream(
+                model=GEMINI_MODEL,
+                contents=prompt
+            ),
+            idempotent=False
+        )
+        async for chunk in stream:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+    gemini_usage.record(
+        "generated_content", estimate_tokens(prompt), builder.trimmed_tokens, time.perf_counter() - started, usage
+    )
+    await response_cache.set("generated_content", [prompt], "".join(chunks).strip())
 
 @app.post("/generate-content")
-def generate_content_endpoint(request: GenerateRequest):
+async def generate_content_endpoint(request: GenerateRequest):
     """
     Complete workflow for generating content (social post, YouTube script, or IG reel script).
+    Identical concurrent requests share a single run of the pipeline; a `use_cache=false`
+    request never joins a run that may be answered from the cache.
     """
-    global USER_PROMPT
-    USER_PROMPT = request.query  # Save for context, but not thread-safe!
+    key = ResponseCache.make_key("generate_content", [request.query, request.format, request.use_cache])
+    ctx = await content_flight.do(key, lambda: run_content_pipeline(PipelineContext.from_request(request)))
+    return {
+        "result": ctx.result,
+        "timings": {stage: round(seconds, 4) for stage, seconds in ctx.timings.items()},
+        "semantic_cache": ctx.semantic_hit
+    }
 
-    # Step 1: Generate search query from user prompt
-    search_query = generate_search_query_from_user_input(USER_PROMPT)
 
-    # Step 2: Search using Tavily and get relevant URLs
-    search_urls = tavily_search(search_query, max_results=5)
+def _sse(event: str, data: Any) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    # Step 3: Expand those URLs using site maps
-    expanded_urls = tavily_sitemap(search_urls)
 
-    # Step 4: Gemini filters the URLs based on original user input
-    top_filtered_urls = gemini_filter_urls_via_prompt(USER_PROMPT, expanded_urls)
+@app.post("/generate-content/stream")
+async def generate_content_stream_endpoint(request: GenerateRequest):
+    """
+    Streaming variant of /generate-content. Emits a Server-Sent Event as each
+    stage completes (search_query, search_results, sitemap, filtered_urls, crawl),
+    then the final text as `token` events while Gemini generates it, and a
+    closing `done` event with the full result and stage timings. A semantic cache
+    hit is announced with a `semantic_cache` event and skips the stages it covers.
+    Failures end the stream with an `error` event.
+    """
+    ctx = PipelineContext.from_request(request)
+
+    async def search_and_crawl_events() -> AsyncIterator[str]:
+        """Steps 1-5, emitting an event as each one completes."""
+        with ctx.stage("search_query"):
+            ctx.search_query = await generate_search_query_from_user_input(ctx.query, use_cache=ctx.use_cache)
+        yield _sse("search_query", {"query": ctx.search_query})
+
+        with ctx.stage("search"):
+            ctx.search_urls = await tavily_search(ctx.search_query, max_results=5, use_cache=ctx.use_cache)
+        yield _sse("search_results", {"urls": ctx.search_urls})
+
+        with ctx.stage("sitemap"):
+            ctx.expanded_urls = await tavily_sitemap(ctx.search_urls, use_cache=ctx.use_cache)
+        yield _sse("sitemap", {"count": len(ctx.expanded_urls)})
+
+        with ctx.stage("filter"):
+            ctx.filtered_urls = await gemini_filter_urls_via_prompt(
+                ctx.query, ctx.expanded_urls, use_cache=ctx.use_cache
+            )
+        yield _sse("filtered_urls", {"urls": ctx.filtered_urls})
+
+        # Relay crawl progress while the crawl runs. Waits on the crawl task as well as the
+        # queue: a URL whose result never reaches on_progress must not stall the stream
+        with ctx.stage("crawl"):
+            progress: asyncio.Queue = asyncio.Queue()
+            crawl = asyncio.ensure_future(
+                tavily_crawl(ctx.filtered_urls, use_cache=ctx.use_cache, on_progress=progress.put_nowait)
+            )
+            get: Optional[asyncio.Future] = None
+            done = 0
+
+            def crawl_event(item: Dict[str, Any]) -> str:
+                return _sse("crawl", {
+                    "url": item["url"],
+                    "ok": not item.get("error"),
+                    "done": done,
+                    "total": len(ctx.filtered_urls)
+                })
+
+            try:
+                while True:
+                    get = asyncio.ensure_future(progress.get())
+                    await asyncio.wait({crawl, get}, return_when=asyncio.FIRST_COMPLETED)
+                    if not get.done():
+                        break
+                    done += 1
+                    yield crawl_event(get.result())
+                # The crawl finished: relay anything it reported after the last get
+                while not progress.empty():
+                    done += 1
+                    yield crawl_event(progress.get_nowait())
+                ctx.crawled = await crawl
+            finally:
+                crawl.cancel()
+                if get is not None:
+                    get.cancel()
+
+    async def events() -> AsyncIterator[str]:
+        yield _sse("started", {"query": ctx.query, "format": ctx.format})
+        try:
+            hit = None
+            if ctx.use_cache:
+                with ctx.stage("semantic_cache"):
+                    hit = semantic_cache.restore(ctx)
+            if hit is not None:
+                yield _sse("semantic_cache", ctx.semantic_hit)
+            if hit == "result":
+                yield _sse("token", {"text": ctx.result})
+                yield _sse("done", {
+                    "result": ctx.result,
+                    "timings": {stage: round(seconds, 4) for stage, seconds in ctx.timings.items()}
+                })
+                return
+            if hit is None:
+                async for event in search_and_crawl_events():
+                    yield event
+
+            chunks = []
+            with ctx.stage("generate"):
+                async for text in stream_content_with_gemini(
+                        ctx.query, ctx.crawled, output_format=ctx.format, use_cache=ctx.use_cache
+                ):
+                    chunks.append(text)
+                    yield _sse("token", {"text": text})
+            ctx.result = "".join(chunks).strip()
+            if ctx.use_cache:
+                semantic_cache.add(ctx)
+            yield _sse("done", {
+                "result": ctx.result,
+                "timings": {stage: round(seconds, 4) for stage, seconds in ctx.timings.items()}
+            })
+        except HTTPException as e:
+            yield _sse("error", {"error": e.detail})
+        except Exception as e:
+            traceback.print_exc()
+            yield _sse("error", {"error": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    # Step 5: Crawl the filtered URLs
-    crawled_info = tavily_crawl(top_filtered_urls)
+
+@app.get("/singleflight/stats")
+async def singleflight_stats():
+    """How many thumbnail and content generations were coalesced into an in-flight call."""
+    return {flight.name: flight.stats() for flight in (thumbnail_flight, content_flight)}
+
+
+metrics.describe("creatorcompass_cache_requests_total", "counter", "Response cache lookups by stage and result")
+metrics.describe("creatorcompass_cache_entries", "gauge", "Entries in the response cache")
+metrics.describe("creatorcompass_semantic_cache_lookups_total", "counter", "Semantic cache lookups by result (result, intermediates, miss)")
+metrics.describe("creatorcompass_semantic_cache_hit_ratio", "gauge", "Share of semantic cache lookups that reused an earlier run")
+metrics.describe("creatorcompass_preset_pool_images", "gauge", "Pre-generated backgrounds held per preset")
+metrics.describe("creatorcompass_preset_pool_requests_total", "counter", "Preset requests served from the pool (hit) or sent to DALL-E (miss)")
+metrics.describe("creatorcompass_semantic_cache_entries", "gauge", "Runs held in the semantic cache by format")
+metrics.describe("creatorcompass_singleflight_calls_total", "counter", "Calls started or coalesced by single-flight")
+metrics.describe("creatorcompass_singleflight_in_flight", "gauge", "Distinct calls currently in flight")
+metrics.describe("creatorcompass_image_pool_pending", "gauge", "Jobs queued or running on the image worker pool")
+metrics.describe("creatorcompass_image_pool_rejected_total", "counter", "Image jobs rejected with 429")
+metrics.describe("creatorcompass_gemini_tokens_total", "counter", "Gemini tokens by stage and kind")
+metrics.describe("creatorcompass_rate_limit_wait_seconds_total", "counter", "Time spent waiting on client-side rate limits")
+metrics.describe("creatorcompass_upstream_calls_total", "counter", "Upstream calls by outcome (retries, hedges, fail-fast rejections)")
+metrics.describe("creatorcompass_circuit_open", "gauge", "1 while an upstream's circuit breaker is open or half-open")
+
+
+async def collect_component_metrics() -> None:
+    """Copy the cache, semantic cache, single-flight, image and preset pool and Gemini counters into the registry."""
+    for stage, hits in response_cache.hits.items():
+        metrics.set("creatorcompass_cache_requests_total", hits, {"stage": stage, "result": "hit"})
+    for stage, misses in response_cache.misses.items():
+        metrics.set("creatorcompass_cache_requests_total", misses, {"stage": stage, "result": "miss"})
+    metrics.set("creatorcompass_cache_entries", len(response_cache.backend))
+    semantic_stats = semantic_cache.stats()
+    for result in ("result", "intermediates", "miss"):
+        metrics.set("creatorcompass_semantic_cache_lookups_total", semantic_stats[result], {"result": result})
+    metrics.set("creatorcompass_semantic_cache_hit_ratio", semantic_stats["hit_rate"])
+    for output_format, count in semantic_stats["entries"].items():
+        metrics.set("creatorcompass_semantic_cache_entries", count, {"format": output_format})
+    for flight in (thumbnail_flight, content_flight):
+        stats = flight.stats()
+        metrics.set("creatorcompass_singleflight_calls_total", stats["calls"], {"flight": flight.name, "result": "started"})
+        metrics.set("creatorcompass_singleflight_calls_total", stats["coalesced"], {"flight": flight.name, "result": "coalesced"})
+        metrics.set("creatorcompass_singleflight_in_flight", stats["in_flight"], {"flight": flight.name})
+    metrics.set("creatorcompass_image_pool_pending", image_pool.pending)
+    pool_stats = preset_pool.stats()
+    for preset, count in pool_stats["images"].items():
+        metrics.set("creatorcompass_preset_pool_images", count, {"preset": preset})
+    metrics.set("creatorcompass_preset_pool_requests_total", pool_stats["hits"], {"result": "hit"})
+    metrics.set("creatorcompass_preset_pool_requests_total", pool_stats["misses"], {"result": "miss"})
+    metrics.set("creatorcompass_image_pool_rejected_total", image_pool.rejected)
+    for name, upstream in upstreams.items():
+        metrics.set("creatorcompass_rate_limit_wait_seconds_total", round(upstream.bucket.waited, 3), {"upstream": name})
+        metrics.set("creatorcompass_circuit_open", int(upstream.breaker.state != "closed"), {"upstream": name})
+        for outcome, count in upstream.counts.items():
+            metrics.set("creatorcompass_upstream_calls_total", count, {"upstream": name, "outcome": outcome})
+    job_stats = await job_queue.stats()
+    metrics.set("creatorcompass_job_queue_depth", job_stats["queue_depth"])
+    metrics.set("creatorcompass_jobs_running", job_stats["running"])
+    for status in JobQueue.STATUSES:
+        metrics.set("creatorcompass_jobs", job_stats["jobs"].get(status, 0), {"status": status})
+    for stage, totals in gemini_usage.stages.items():
+        for kind in ("prompt_tokens", "cached_tokens", "response_tokens", "trimmed_tokens"):
+            metrics.set("creatorcompass_gemini_tokens_total", totals[kind], {"stage": stage, "kind": kind.rsplit("_", 1)[0]})
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Stage latency histograms, in-flight gauges and error counters in Prometheus text format."""
+    await collect_component_metrics()
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+async def run_content_pipeline(ctx: PipelineContext) -> PipelineContext:
+    """
+    Run the six content generation steps, recording each one's output on `ctx`.
+    A semantically similar earlier run supplies the result, or steps 1-5, when caching is on.
+    """
+    hit = None
+    if ctx.use_cache:
+        with ctx.stage("semantic_cache"):
+            hit = semantic_cache.restore(ctx)
+        if hit == "result":
+            return ctx
+
+    if hit is None:
+        # Step 1: Generate search query from user prompt
+        with ctx.stage("search_query"):
+            ctx.search_query = await generate_search_query_from_user_input(ctx.query, use_cache=ctx.use_cache)
+
+        # Step 2: Search using Tavily and get relevant URLs
+        with ctx.stage("search"):
+            ctx.search_urls = await tavily_search(ctx.search_query, max_results=5, use_cache=ctx.use_cache)
+
+        # Step 3: Expand those URLs using site maps
+        with ctx.stage("sitemap"):
+            ctx.expanded_urls = await tavily_sitemap(ctx.search_urls, use_cache=ctx.use_cache)
+
+        # Step 4: Gemini filters the URLs based on original user input
+        with ctx.stage("filter"):
+            ctx.filtered_urls = await gemini_filter_urls_via_prompt(ctx.query, ctx.expanded_urls, use_cache=ctx.use_cache)
+
+        # Step 5: Crawl the filtered URLs
+        with ctx.stage("crawl"):
+            ctx.crawled = await tavily_crawl(ctx.filtered_urls, use_cache=ctx.use_cache)
 
     # Step 6: Generate the final output in the requested format
-    final_text = generate_content_with_gemini(USER_PROMPT, crawled_info, output_format=request.format)
+    with ctx.stage("generate"):
+        ctx.result = await generate_content_with_gemini(
+            ctx.query, ctx.crawled, output_format=ctx.format, use_cache=ctx.use_cache
+        )
+    if ctx.use_cache:
+        semantic_cache.add(ctx)
+
+    return ctx
+
+# Background jobs: generation runs off the request path and survives restarts
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "2"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+JOB_SQLITE_PATH = os.getenv(
+    "JOB_SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "jobs.sqlite3")
+)
+# Hosts job callbacks may target, comma-separated; when unset any host with only public addresses is allowed
+JOB_CALLBACK_HOSTS = {host.strip().lower() for host in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if host.strip()}
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])  # Drop an IPv6 zone id
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_callback_url(url: str) -> str:
+    """
+    Reject callback URLs that could point the server at itself or its network: only
+    http(s), and either a host from JOB_CALLBACK_HOSTS or, without an allowlist, no
+    private, loopback, link-local or otherwise non-public IP literal. Host names are
+    resolved and checked again when the callback is sent (see `callback_target_allowed`).
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError("callback_url must be an absolute http(s) URL")
+    if JOB_CALLBACK_HOSTS:
+        if host not in JOB_CALLBACK_HOSTS:
+            raise ValueError(f"callback_url host must be one of: {', '.join(sorted(JOB_CALLBACK_HOSTS))}")
+        return url
+    try:
+        public = _is_public_address(host)
+    except ValueError:
+        public = host != "localhost" and not host.endswith((".localhost", ".local", ".internal"))
+    if not public:
+        raise ValueError("callback_url must not target a private, loopback or link-local address")
+    return url
+
+
+async def callback_target_allowed(url: str) -> bool:
+    """Whether every address the callback host resolves to right now is public (or the host is allowlisted)."""
+    parts = urlsplit(url)
+    if JOB_CALLBACK_HOSTS:
+        return (parts.hostname or "").lower() in JOB_CALLBACK_HOSTS
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            parts.hostname, parts.port or (443 if parts.scheme == "https" else 80), type=socket.SOCK_STREAM
+        )
+    except (OSError, UnicodeError):
+        return False
+    return bool(infos) and all(_is_public_address(info[4][0]) for info in infos)
+
+
+class JobStore:
+    """
+    SQLite table of jobs, so queued and interrupted work is picked up again after a restart.
+    Every statement runs on one dedicated thread: the event loop never waits on a commit,
+    and the connection is only ever used by a single writer.
+    """
+
+    COLUMNS = ("id", "kind", "payload", "priority", "status", "attempts", "max_attempts", "result", "error",
+               "callback_url", "created_at", "started_at", "finished_at")
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+            "result TEXT, error TEXT, callback_url TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self._conn.commit()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+    async def _call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+
+    async def insert(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a new job and return it as read back."""
+        return await self._call(self._insert, job)
+
+    async def update(self, job_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        """Change a job's fields and return its new state."""
+        return await self._call(self._update, job_id, fields)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._call(self._get, job_id)
+
+    async def recover(self) -> List[Tuple[str, int, float]]:
+        """Requeue jobs interrupted mid-run and return (id, priority, created_at) of every queued job."""
+        return await self._call(self._recover)
+
+    async def counts(self) -> Dict[str, int]:
+        return await self._call(self._counts)
+
+    def _insert(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        row = {**job, "payload": json.dumps(job["payload"])}
+        self._conn.execute(
+            f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+            [row.get(column) for column in self.COLUMNS]
+        )
+        self._conn.commit()
+        return self._get(job["id"])
+
+    def _update(self, job_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        self._conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in fields)} WHERE id = ?",
+            [*fields.values(), job_id]
+        )
+        self._conn.commit()
+        return self._get(job_id)
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def _recover(self) -> List[Tuple[str, int, float]]:
+        self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status IN ('running', 'retrying')")
+        self._conn.execute(
+            "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+            (time.time() - JOB_RETENTION,)
+        )
+        self._conn.commit()
+        return self._conn.execute("SELECT id, priority, created_at FROM jobs WHERE status = 'queued'").fetchall()
+
+    def _counts(self) -> Dict[str, int]:
+        return dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class JobQueue:
+    """
+    Priority queue of generation jobs drained by a fixed number of worker tasks.
+    Higher `priority` runs first, then oldest first. Failed attempts are retried with
+    exponential backoff; client errors (4xx other than 429) are not retried.
+    Watchers receive every state change, and a job's `callback_url` is POSTed the final state.
+    The SQLite store at `path` is opened by `start()`, so importing the app touches no files.
+    """
+
+    STATUSES = ("queued", "running", "retrying", "succeeded", "failed")
+    TERMINAL = ("succeeded", "failed")
+
+    def __init__(self, path: str, workers: int, max_attempts: int, backoff: float):
+        self.path = path
+        self.store: Optional[JobStore] = None
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.running = 0
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._watchers: Dict[str, List[asyncio.Queue]] = {}
+        self._background_tasks: set = set()
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Awaitable[Any]]) -> None:
+        self._handlers[kind] = handler
+
+    async def start(self) -> None:
+        self._queue = asyncio.PriorityQueue()
+        if self.store is None:
+            self.store = await asyncio.to_thread(JobStore, self.path)
+        for job_id, priority, created_at in await self.store.recover():
+            self._queue.put_nowait((-priority, created_at, job_id))
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        # Interrupted jobs stay 'running' (or 'retrying') in the store and are requeued by the next start()
+        tasks = self._tasks + list(self._background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(
+            self,
+            kind: str,
+            payload: Dict[str, Any],
+            priority: int = 0,
+            callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        if self._queue is None:
+            raise HTTPException(status_code=503, detail="Job queue is not running")
+        job = {
+            "id": os.urandom(12).hex(),
+            "kind": kind,
+            "payload": payload,
+            "priority": priority,
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "callback_url": callback_url,
+            "created_at": time.time(),
+        }
+        stored = await self.store.insert(job)
+        self._queue.put_nowait((-priority, job["created_at"], job["id"]))
+        return stored
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if self.store is None:
+            raise HTTPException(status_code=503, detail="Job queue is not running")
+        return await self.store.get(job_id)
+
+    def watch(self, job_id: str) -> asyncio.Queue:
+        watcher: asyncio.Queue = asyncio.Queue()
+        self._watchers.setdefault(job_id, []).append(watcher)
+        return watcher
+
+    def unwatch(self, job_id: str, watcher: asyncio.Queue) -> None:
+        watchers = self._watchers.get(job_id, [])
+        if watcher in watchers:
+            watchers.remove(watcher)
+        if not watchers:
+            self._watchers.pop(job_id, None)
+
+    async def _update(self, job_id: str, **fields: Any) -> Dict[str, Any]:
+        job = await self.store.update(job_id, **fields)
+        for watcher in self._watchers.get(job_id, []):
+            watcher.put_nowait(job)
+        return job
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            try:
+                job = await self.store.get(job_id)
+                if job is None or job["status"] != "queued":
+                    continue
+                self.running += 1
+                try:
+                    await self._run(job)
+                finally:
+                    self.running -= 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # A store error must not take the worker down; the job is requeued by the next start()
+                print(f"Job worker: job {job_id} could not be run or recorded ({type(e).__name__}: {e})")
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        attempts = job["attempts"] + 1
+        await self._update(job["id"], status="running", attempts=attempts, started_at=time.time())
+        try:
+            handler = self._handlers[job["kind"]]
+            with stage_timer(f"job_{job['kind']}"):
+                result = await handler(job["payload"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status_code = e.status_code if isinstance(e, HTTPException) else 500
+            error = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+            retryable = status_code >= 500 or status_code == 429
+            if retryable and attempts < job["max_attempts"]:
+                await self._update(job["id"], status="retrying", error=error)
+                delay = self.backoff * 2 ** (attempts - 1)
+                self._background(self._requeue(job["id"], job["priority"], job["created_at"], delay))
+                return
+            job = await self._update(job["id"], status="failed", error=error, finished_at=time.time())
+        else:
+            job = await self._update(job["id"], status="succeeded", result=result, error=None, finished_at=time.time())
+        if job["callback_url"]:
+            self._background(self._callback(job))
+
+    def _background(self, coroutine: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _requeue(self, job_id: str, priority: int, created_at: float, delay: float) -> None:
+        await asyncio.sleep(delay)
+        try:
+            await self._update(job_id, status="queued")
+        except Exception as e:
+            print(f"Job worker: requeueing job {job_id} failed ({type(e).__name__}: {e})")
+            return
+        self._queue.put_nowait((-priority, created_at, job_id))
+
+    async def _callback(self, job: Dict[str, Any]) -> None:
+        """POST the final job state to its callback URL, retrying a few times."""
+        # Checked again at send time: the host may now resolve somewhere it did not at submission
+        if not await callback_target_allowed(job["callback_url"]):
+            print(f"Callback for job {job['id']} refused: {job['callback_url']} does not resolve to a public address")
+            return
+        for attempt in range(3):
+            try:
+                # Redirects could lead anywhere, so they are not followed
+                response = await get_http_client().post(
+                    job["callback_url"], json=job_view(job), timeout=10, follow_redirects=False
+                )
+                if response.status_code < 500:
+                    return
+            except httpx.HTTPError as e:
+                print(f"Callback for job {job['id']} failed: {e}")
+            await asyncio.sleep(2 ** attempt)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "running": self.running,
+            "workers": self.workers,
+            "jobs": await self.store.counts() if self.store is not None else {}
+        }
+
+
+def job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public representation of a job."""
+    view = {key: job[key] for key in ("id", "kind", "status", "priority", "attempts", "max_attempts",
+                                      "result", "error", "created_at", "started_at", "finished_at")}
+    view["status_url"] = f"/jobs/{job['id']}"
+    view["events_url"] = f"/jobs/{job['id']}/events"
+    return view
+
+
+job_queue = JobQueue(JOB_SQLITE_PATH, JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF)
+
+
+async def _run_thumbnail_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return await render_thumbnail(ThumbnailRequest(**payload))
+
+
+async def _run_content_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    ctx = await run_content_pipeline(PipelineContext.from_request(GenerateRequest(**payload)))
+    return {"result": ctx.result, "timings": ctx.timings}
+
+
+job_queue.register("thumbnail", _run_thumbnail_job)
+job_queue.register("content", _run_content_job)
+
+
+class JobOptions(BaseModel):
+    priority: int = Field(0, description="Higher runs first")
+    callback_url: Optional[str] = Field(None, description="URL that receives a POST with the finished job")
+
+    @field_validator("callback_url")
+    @classmethod
+    def _check_callback_url(cls, callback_url: Optional[str]) -> Optional[str]:
+        return check_callback_url(callback_url) if callback_url is not None else None
+
+
+class ThumbnailJobRequest(ThumbnailRequest, JobOptions):
+    pass
+
+
+class ContentJobRequest(GenerateRequest, JobOptions):
+    pass
+
+
+async def _submit_job(kind: str, request: BaseModel) -> JSONResponse:
+    options = set(JobOptions.model_fields)
+    job = await job_queue.submit(
+        kind, request.model_dump(exclude=options), priority=request.priority, callback_url=request.callback_url
+    )
+    return JSONResponse(job_view(job), status_code=202, headers={"Location": f"/jobs/{job['id']}"})
+
+
+@app.post("/jobs/thumbnail", status_code=202)
+async def submit_thumbnail_job(request: ThumbnailJobRequest):
+    """Queue a thumbnail generation (same fields as /generate/thumbnail) and return its job id immediately."""
+    return await _submit_job("thumbnail", request)
+
+
+@app.post("/jobs/content", status_code=202)
+async def submit_content_job(request: ContentJobRequest):
+    """Queue a content generation (same fields as /generate-content) and return its job id immediately."""
+    return await _submit_job("content", request)
+
+
+@app.get("/jobs/stats")
+async def job_stats():
+    """Queue depth, running jobs and job counts by status."""
+    return await job_queue.stats()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Poll a job's status; `result` is set once it has succeeded."""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_view(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events with the job's state on every change, ending once it succeeds or fails."""
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events() -> AsyncIterator[str]:
+        watcher = job_queue.watch(job_id)
+        try:
+            # Read after subscribing so no transition between the two is missed
+            job = await job_queue.get(job_id)
+            while True:
+                yield _sse(job["status"], job_view(job))
+                if job["status"] in JobQueue.TERMINAL:
+                    return
+                job = await watcher.get()
+        finally:
+            job_queue.unwatch(job_id, watcher)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+metrics.describe("creatorcompass_job_queue_depth", "gauge", "Jobs waiting for a worker")
+metrics.describe("creatorcompass_jobs_running", "gauge", "Jobs currently running")
+metrics.describe("creatorcompass_jobs", "gauge", "Stored jobs by status")
 
-    return {"result": final_text}
 
 # Run the app
 if __name__ == "__main__":
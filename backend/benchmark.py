@@ -0,0 +1,1064 @@
+"""
+Micro-benchmarks for the backend, run against stubbed upstream clients.
+
+Usage (from the repository root):
+    python backend/benchmark.py pipeline --runs 20 --latency 0.2
+    python backend/benchmark.py prompts --iterations 2000
+    python backend/benchmark.py downloads --requests 200 --concurrency 20
+    python backend/benchmark.py imaging --images 16
+    python backend/benchmark.py overlay --iterations 20
+    python backend/benchmark.py fonts --iterations 200
+    python backend/benchmark.py renditions --runs 5
+    python backend/benchmark.py stream --runs 5 --latency 0.2
+    python backend/benchmark.py prefilter --sizes 10000 100000
+    python backend/benchmark.py batch --items 40 --rate 10
+    python backend/benchmark.py presets --requests 24 --latency 2
+    python backend/benchmark.py binary --requests 20 --concurrency 16
+    python backend/benchmark.py resilience --calls 300 --error-rate 0.1
+    python backend/benchmark.py isolation --requests 200
+    python backend/benchmark.py semantic --latency 0.05
+    python backend/benchmark.py startup --runs 5 --budget-ms 1500
+"""
+import argparse
+import asyncio
+import collections
+import io
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import timeit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+# Provider clients are built on first use and every benchmark swaps in stubs, so no credentials are needed
+os.environ.setdefault("GEMINI_CONTEXT_CACHE", "0")  # The stub clients have no caches API
+
+import httpx  # noqa: E402
+import openai  # noqa: E402
+import tavily.errors  # noqa: E402
+import requests  # noqa: E402
+import yaml  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+import app  # noqa: E402
+
+
+class StubTavilyClient:
+    """Async Tavily stand-in that sleeps for a fixed latency per call."""
+
+    def __init__(self, latency: float, urls_per_map: int = 20):
+        self.latency = latency
+        self.urls_per_map = urls_per_map
+
+    async def search(self, query: str, **kwargs) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency)
+        return {"results": [{"url": f"https://site{i}.example/"} for i in range(kwargs.get("max_results", 5))]}
+
+    async def map(self, url: str, **kwargs) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency)
+        return {"urls": [f"{url}page/{i}" for i in range(self.urls_per_map)]}
+
+    async def crawl(self, url: str, **kwargs) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency)
+        return {"content": f"Crawled content for {url}. " * 50}
+
+
+class StubGeminiClient:
+    """Gemini stand-in exposing the `client.aio.models.generate_content` surface."""
+
+    def __init__(self, latency: float, chunks: int = 10):
+        self.latency = latency
+        self.chunks = chunks
+        self.aio = SimpleNamespace(models=SimpleNamespace(
+            generate_content=self._generate_content,
+            generate_content_stream=self._generate_content_stream
+        ))
+
+    async def _generate_content(self, model: str, contents: str, config: Any = None) -> Any:
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(text="stub response")
+
+    async def _generate_content_stream(self, model: str, contents: str, config: Any = None) -> Any:
+        async def chunks():
+            for i in range(self.chunks):
+                await asyncio.sleep(self.latency / self.chunks)
+                yield SimpleNamespace(text=f"chunk {i} ")
+        return chunks()
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _report(name: str, samples: List[float]) -> None:
+    print(
+        f"{name:<12} runs={len(samples):<4} "
+        f"p50={statistics.median(samples) * 1000:8.1f}ms "
+        f"p95={_percentile(samples, 95) * 1000:8.1f}ms "
+        f"max={max(samples) * 1000:8.1f}ms"
+    )
+
+
+async def _sequential_pipeline(query: str) -> None:
+    """The pre-async pipeline shape: every per-URL call waits for the previous one."""
+    search_query = await app.generate_search_query_from_user_input(query, use_cache=False)
+    search_urls = await app.tavily_search(search_query, max_results=5, use_cache=False)
+    expanded = []
+    for url in search_urls:
+        result = await app.tavily_client.map(url=url)
+        expanded.extend(result["urls"])
+    filtered = await app.gemini_filter_urls_via_prompt(query, expanded, use_cache=False)
+    crawled = []
+    for url in filtered:
+        result = await app.tavily_client.crawl(url=url)
+        crawled.append({"url": url, "content": result.get("content", "")})
+    await app.generate_content_with_gemini(query, crawled, use_cache=False)
+
+
+async def bench_pipeline(args: argparse.Namespace) -> None:
+    app.tavily_client = StubTavilyClient(args.latency)
+    app.gemini_client = StubGeminiClient(args.latency)
+    # Bypass the response cache so every run pays the full upstream latency
+    request = app.GenerateRequest(query="best budget microphones for youtubers", use_cache=False)
+
+    for name, run in [
+        ("sequential", lambda: _sequential_pipeline(request.query)),
+        ("concurrent", lambda: app.generate_content_endpoint(request)),
+    ]:
+        samples = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            await run()
+            samples.append(time.perf_counter() - start)
+        _report(name, samples)
+
+
+async def bench_prompts(args: argparse.Namespace) -> None:
+    def read_and_parse() -> str:
+        # What load_prompt did before the registry: open and parse on every call
+        with open(app.PROMPTS_PATH, "r") as file:
+            return yaml.safe_load(file).get("gemini_search", "")
+
+    for name, fn in [
+        ("parse/call", read_and_parse),
+        ("registry", lambda: app.load_prompt("gemini_search")),
+    ]:
+        total = timeit.timeit(fn, number=args.iterations)
+        print(f"{name:<12} {total / args.iterations * 1e6:10.1f}us per lookup")
+
+
+class StubImageServer:
+    """
+    Local keep-alive HTTP server that serves one generated JPEG and counts TCP connections.
+    Loopback connections are nearly free, so `handshake` seconds are slept per new
+    connection to stand in for the TCP/TLS setup cost of a real image host.
+    """
+
+    def __init__(self, size=(1792, 1024), handshake: float = 0.0, noise: bool = False):
+        buffer = io.BytesIO()
+        if noise:
+            # Photo-like detail, so encoded sizes are realistic
+            image = Image.merge("RGB", [Image.effect_noise(size, sigma) for sigma in (20, 30, 40)])
+        else:
+            image = Image.new("RGB", size, (200, 80, 40))
+        image.save(buffer, format="JPEG", quality=95)
+        body = buffer.getvalue()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # Headers and body go out in separate writes
+
+            def setup(self):
+                server.connections += 1
+                time.sleep(handshake)
+                super().setup()
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.connections = 0
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/image.jpg"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+async def bench_downloads(args: argparse.Namespace) -> None:
+    async def per_call_requests(url: str) -> None:
+        # What download_and_process_image did before: a fresh connection per call in the default executor
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(None, lambda: requests.get(url, timeout=30))
+        response.raise_for_status()
+
+    async def pooled(url: str) -> None:
+        await app.generator.download_image(url)
+
+    for name, download in [("requests.get", per_call_requests), ("pooled", pooled)]:
+        with StubImageServer(handshake=args.handshake_ms / 1000) as server:
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one() -> None:
+                async with semaphore:
+                    await download(server.url)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(args.requests)))
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:<12} {args.requests / elapsed:8.1f} downloads/s  "
+                f"connections opened={server.connections}"
+            )
+    await app.close_http_client()
+
+
+async def _max_loop_lag(work: Any, interval: float = 0.005) -> float:
+    """Run `work` while a ticker measures the worst event loop scheduling delay."""
+    worst = 0.0
+    done = False
+
+    async def ticker() -> None:
+        nonlocal worst
+        while not done:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            worst = max(worst, time.perf_counter() - expected)
+
+    task = asyncio.create_task(ticker())
+    await work
+    done = True
+    await task
+    return worst
+
+
+async def bench_imaging(args: argparse.Namespace) -> None:
+    source = io.BytesIO()
+    Image.new("RGB", (1792, 1024), (200, 80, 40)).save(source, format="PNG")
+    payload = source.getvalue()
+
+    def process() -> None:
+        app.generator._process_image(
+            io.BytesIO(payload), "BENCHMARK", 60, "white", "black", 3, "center", {}
+        )
+
+    async def inline() -> None:
+        # What download_and_process_image did before: Pillow work directly on the loop thread
+        for _ in range(args.images):
+            process()
+            await asyncio.sleep(0)
+
+    async def pooled() -> None:
+        await asyncio.gather(*(app.image_pool.run(process) for _ in range(args.images)))
+
+    for name, work in [("event loop", inline), ("worker pool", pooled)]:
+        start = time.perf_counter()
+        lag = await _max_loop_lag(work())
+        elapsed = time.perf_counter() - start
+        print(f"{name:<12} images={args.images} total={elapsed * 1000:8.1f}ms max loop lag={lag * 1000:8.1f}ms")
+    app.image_pool.shutdown()
+
+
+async def bench_overlay(args: argparse.Namespace) -> None:
+    base = Image.new("RGB", app.generator.thumbnail_size, (200, 80, 40))
+    font = app.ImageFont.load_default(size=60)
+
+    def offset_stroke(text: str, stroke_width: int) -> None:
+        # What _add_text_overlay did before: one full render per stroke offset
+        img = base.copy()
+        draw = ImageDraw.Draw(img)
+        for dx in range(-stroke_width, stroke_width + 1):
+            for dy in range(-stroke_width, stroke_width + 1):
+                if dx != 0 or dy != 0:
+                    draw.text((100 + dx, 300 + dy), text, font=font, fill="black")
+        draw.text((100, 300), text, font=font, fill="white")
+
+    def native_stroke(text: str, stroke_width: int) -> None:
+        img = base.copy()
+        ImageDraw.Draw(img).text(
+            (100, 300), text, font=font, fill="white", stroke_width=stroke_width, stroke_fill="black"
+        )
+
+    for text in ["SHORT", "A MUCH LONGER THUMBNAIL OVERLAY TITLE"]:
+        for stroke_width in [1, 3, 6, 10]:
+            row = [f"len={len(text):<3} w={stroke_width:<3}"]
+            for name, fn in [("offsets", offset_stroke), ("native", native_stroke)]:
+                total = timeit.timeit(lambda: fn(text, stroke_width), number=args.iterations)
+                row.append(f"{name}={total / args.iterations * 1000:7.2f}ms")
+            print("  ".join(row))
+
+
+async def bench_fonts(args: argparse.Namespace) -> None:
+    path = app.font_registry.path
+    base = Image.new("RGB", app.generator.thumbnail_size, (200, 80, 40))
+    draw = ImageDraw.Draw(base)
+    title = "THE BEST BUDGET MICROPHONES FOR YOUTUBERS IN 2026"
+
+    for name, fn in [
+        # What _add_text_overlay did before: parse the font file on every request
+        ("truetype/call", lambda: app.ImageFont.truetype(path, 60) if path else app.ImageFont.load_default(size=60)),
+        ("registry", lambda: app.font_registry.get(60)),
+        ("auto-fit", lambda: app.generator._fit_text(draw, title, 1180, 620, 3)),
+    ]:
+        total = timeit.timeit(fn, number=args.iterations)
+        print(f"{name:<14} {total / args.iterations * 1e6:10.1f}us per overlay setup")
+
+
+async def bench_renditions(args: argparse.Namespace) -> None:
+    # Noise compresses like a photo, unlike a flat colour
+    source = Image.merge("RGB", [Image.effect_noise((1792, 1024), 64) for _ in range(3)])
+    buffer = io.BytesIO()
+    source.save(buffer, format="PNG")
+    payload = buffer.getvalue()
+    sizes = list(app.RENDITION_SIZES)
+    formats = list(app.RENDITION_FORMATS)
+    generator = app.generator
+
+    async def naive() -> Dict[str, int]:
+        # Decode and LANCZOS-resize from full resolution for every rendition, encode one at a time
+        output = {}
+        for size in sizes:
+            for image_format in formats:
+                img = Image.open(io.BytesIO(payload)).convert("RGB")
+                img = img.resize(app.RENDITION_SIZES[size], Image.Resampling.LANCZOS)
+                output[f"{size}.{image_format}"] = len(generator._encode_rendition(img, image_format))
+        return output
+
+    async def cascade() -> Dict[str, int]:
+        base = await app.image_pool.run(
+            generator._compose_image, io.BytesIO(payload), None, 60, "white", "black", 3, "center", {}
+        )
+        scaled = await app.image_pool.run(
+            generator._downscale_cascade, base, [app.RENDITION_SIZES[size] for size in sizes]
+        )
+        variants = [(size, image_format) for size in sizes for image_format in formats]
+        encoded = await asyncio.gather(*(
+            app.image_pool.run(generator._encode_rendition, scaled[app.RENDITION_SIZES[size]], image_format)
+            for size, image_format in variants
+        ))
+        return {f"{size}.{image_format}": len(data) for (size, image_format), data in zip(variants, encoded)}
+
+    for name, run in [("naive", naive), ("cascade", cascade)]:
+        wall, cpu = [], []
+        for _ in range(args.runs):
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            output = await run()
+            cpu.append(time.process_time() - cpu_start)
+            wall.append(time.perf_counter() - wall_start)
+        print(
+            f"{name:<8} wall p50={statistics.median(wall) * 1000:8.1f}ms "
+            f"cpu p50={statistics.median(cpu) * 1000:8.1f}ms"
+        )
+        print("         " + "  ".join(f"{key}={size}B" for key, size in output.items()))
+    app.image_pool.shutdown()
+
+
+async def bench_stream(args: argparse.Namespace) -> None:
+    app.tavily_client = StubTavilyClient(args.latency)
+    app.gemini_client = StubGeminiClient(args.latency)
+    request = app.GenerateRequest(query="best budget microphones for youtubers", use_cache=False)
+
+    async def buffered() -> Dict[str, float]:
+        start = time.perf_counter()
+        await app.generate_content_endpoint(request)
+        total = time.perf_counter() - start
+        return {"first event": total, "first stage": total, "total": total}
+
+    async def streamed() -> Dict[str, float]:
+        start = time.perf_counter()
+        response = await app.generate_content_stream_endpoint(request)
+        marks = {}
+        async for chunk in response.body_iterator:
+            marks.setdefault("first event", time.perf_counter() - start)
+            if chunk.startswith("event: search_query"):
+                marks["first stage"] = time.perf_counter() - start
+        marks["total"] = time.perf_counter() - start
+        return marks
+
+    for name, run in [("buffered", buffered), ("sse", streamed)]:
+        samples = [await run() for _ in range(args.runs)]
+        print(f"{name:<10} " + "  ".join(
+            f"{key}={statistics.median(s[key] for s in samples) * 1000:8.1f}ms"
+            for key in ["first event", "first stage", "total"]
+        ))
+
+
+def _synthetic_sitemap(size: int, seed: int = 7) -> List[str]:
+    """A sitemap shaped like a large content site: posts, pagination, tags, assets and tracking variants."""
+    rng = random.Random(seed)
+    words = [
+        "microphone", "budget", "youtube", "camera", "lighting", "editing", "review", "guide", "best",
+        "podcast", "audio", "setup", "beginner", "studio", "tips", "2026", "cheap", "streaming", "gear", "vlog"
+    ]
+    urls = []
+    for i in range(size):
+        slug = "-".join(rng.sample(words, 4))
+        kind = rng.random()
+        if kind < 0.6:
+            urls.append(f"https://site.example/blog/{slug}-{i}/")
+        elif kind < 0.7:
+            urls.append(f"https://site.example/blog/page/{i}")
+        elif kind < 0.8:
+            urls.append(f"https://site.example/tag/{rng.choice(words)}-{i}/")
+        elif kind < 0.9:
+            urls.append(f"https://site.example/wp-content/uploads/{slug}-{i}.jpg")
+        else:
+            urls.append(f"https://site.example/blog/{slug}-{i}/?utm_source=newsletter")
+    return urls
+
+
+async def bench_prefilter(args: argparse.Namespace) -> None:
+    query = "best budget microphone for a beginner youtube studio"
+    # Stubbed Gemini whose latency grows with prompt size, like the real model's prefill
+    gemini = StubGeminiClient(args.latency)
+
+    async def generate_content(model: str, contents: str, config: Any = None) -> Any:
+        await asyncio.sleep(args.latency + app.estimate_tokens(contents) / 1000 * args.ms_per_1k_tokens / 1000)
+        return SimpleNamespace(text="[]")
+
+    gemini.aio.models.generate_content = generate_content
+    app.gemini_client = gemini
+    top_n = app.SITEMAP_PREFILTER_TOP_N
+
+    for size in args.sizes:
+        urls = _synthetic_sitemap(size)
+        start = time.perf_counter()
+        app.SITEMAP_PREFILTER_TOP_N = len(urls)  # Effectively disables the prefilter
+        await app.gemini_filter_urls_via_prompt(query, urls, use_cache=False)
+        before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        candidates = app.prefilter_sitemap_urls(query, urls, top_n)
+        prefilter = time.perf_counter() - start
+        app.SITEMAP_PREFILTER_TOP_N = top_n
+        start = time.perf_counter()
+        await app.gemini_filter_urls_via_prompt(query, urls, use_cache=False)
+        after = time.perf_counter() - start
+
+        print(
+            f"urls={size:<7} prompt tokens {app.estimate_tokens(chr(10).join(urls)):>8} -> "
+            f"{app.estimate_tokens(chr(10).join(candidates)):>6}  "
+            f"filter call {before * 1000:8.1f}ms -> {after * 1000:8.1f}ms (prefilter {prefilter * 1000:6.1f}ms)"
+        )
+
+
+class StubDalleClient:
+    """
+    Azure OpenAI stand-in for `client.images.generate` (called from a worker thread)
+    that enforces a per-second quota and answers calls over it with a 429.
+    """
+
+    def __init__(self, image_url: str, latency: float, rate: int, retry_after: float = 1.0):
+        self.image_url = image_url
+        self.latency = latency
+        self.rate = rate
+        self.retry_after = retry_after
+        self.calls = 0
+        self.rejected = 0
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+        self.images = SimpleNamespace(generate=self._generate)
+
+    def _generate(self, **kwargs) -> Any:
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - 1:
+                self._recent.popleft()
+            self.calls += 1
+            if len(self._recent) >= self.rate:
+                self.rejected += 1
+                response = httpx.Response(
+                    429, headers={"retry-after": str(self.retry_after)},
+                    request=httpx.Request("POST", "https://benchmark.invalid/images")
+                )
+                raise openai.RateLimitError("Rate limit exceeded", response=response, body=None)
+            self._recent.append(now)
+        time.sleep(self.latency)
+        return SimpleNamespace(data=[SimpleNamespace(url=self.image_url)])
+
+
+async def bench_batch(args: argparse.Namespace) -> None:
+    with StubImageServer() as server:
+        for name, bucket in [
+            ("unthrottled", app.TokenBucket(rate=1e6, capacity=1e6)),
+            # A burst of one keeps every one-second window within the quota
+            ("token bucket", app.TokenBucket(rate=args.rate * 0.9, capacity=1)),
+        ]:
+            stub = StubDalleClient(server.url, args.latency, args.rate)
+            app.generator.client = stub
+            app.upstreams["azure_openai"].bucket = bucket
+            request = app.BatchThumbnailRequest(
+                items=[{"title": f"{name} video {i}"} for i in range(args.items)],
+                concurrency=args.concurrency
+            )
+            start = time.perf_counter()
+            response = await app.generate_thumbnail_batch(request)
+            lines = [json.loads(line) async for line in response.body_iterator]
+            elapsed = time.perf_counter() - start
+            summary = lines[-1]
+            print(
+                f"{name:<13} {elapsed:6.2f}s  ok={summary['succeeded']:<4} failed={summary['failed']:<4} "
+                f"DALL-E calls={stub.calls:<4} 429s={stub.rejected}"
+            )
+    app.image_pool.shutdown()
+
+
+async def bench_presets(args: argparse.Namespace) -> None:
+    """Preset requests rendered on a pre-generated background vs a fresh (stubbed) DALL-E image."""
+    import tempfile
+
+    presets = list(app.THUMBNAIL_PRESETS)
+    iterations = 2000
+    seconds = timeit.timeit(
+        lambda: app.generator._build_prompt("My video", "modern and professional", "technology", ["code"]), number=iterations
+    )
+    print(f"prompt build: {seconds / iterations * 1e6:.2f}us (template compiled once per style/theme/elements)")
+
+    with StubImageServer() as server, tempfile.TemporaryDirectory() as directory:
+        app.generator.client = StubDalleClient(server.url, args.latency, rate=1000)
+        app.upstreams["azure_openai"].bucket = app.TokenBucket(rate=1e6, capacity=1e6)
+        app.preset_pool = app.PresetPool(directory, args.pool_size, max_uses=10 ** 6, interval=1)
+        start = time.perf_counter()
+        await asyncio.gather(*(app.preset_pool._generate(preset) for preset in presets for _ in range(args.pool_size)))
+        print(f"pool fill: {len(presets) * args.pool_size} backgrounds in {time.perf_counter() - start:.2f}s")
+
+        for name, use_pool in [("fresh", False), ("preset pool", True)]:
+            samples = []
+            for i in range(args.requests):
+                preset = presets[i % len(presets)]
+                request = app.preset_thumbnail_request(preset, title=f"{name} video {i}", overlay_text=f"Part {i}")
+                start = time.perf_counter()
+                result = await app.render_thumbnail(request, preset=preset if use_pool else None)
+                samples.append(time.perf_counter() - start)
+                assert result["source"] == ("preset_pool" if use_pool else "dalle")
+            _report(name, samples)
+    app.image_pool.shutdown()
+
+
+async def _legacy_image_response(image_url: str, request: "app.ThumbnailRequest") -> Any:
+    """The binary path /generate/thumbnail had commented out: copy the encoded buffer, then stream the copy."""
+    from fastapi.responses import StreamingResponse
+
+    img_bytes = await app.generator.download_and_process_image(image_url=image_url, overlay_text=request.overlay_text)
+    await asyncio.to_thread(app.thumbnail_store.save, img_bytes.getvalue())
+    return StreamingResponse(io.BytesIO(img_bytes.read()), media_type="image/jpeg")
+
+
+async def _drain(response: Any, client_delay: float) -> Dict[str, int]:
+    """Send a response the way the server would, to a client reading one chunk per `client_delay` seconds."""
+    sent = {"bytes": 0, "chunks": 0, "copied": 0}
+
+    async def receive() -> Dict[str, Any]:
+        await asyncio.Event().wait()
+
+    async def send(message: Dict[str, Any]) -> None:
+        body = message.get("body")
+        if body:
+            sent["bytes"] += len(body)
+            sent["chunks"] += 1
+            # A view of the encoder's buffer costs nothing; a bytes chunk is a copy of it
+            sent["copied"] += 0 if isinstance(body, memoryview) else len(body)
+            await asyncio.sleep(client_delay)
+
+    await response({"type": "http", "asgi": {"spec_version": "2.4"}, "method": "POST", "headers": []}, receive, send)
+    return sent
+
+
+async def _serve_image(mode: str, server_url: str, i: int, client_delay: float) -> Dict[str, int]:
+    request = app.ThumbnailRequest(title=f"Binary response {i}", overlay_text=f"Episode {i}")
+    if mode == "before":
+        response = await _legacy_image_response(server_url, request)
+    else:
+        http_request = SimpleNamespace(headers={"accept": "image/jpeg"})
+        response = await app.thumbnail_response(http_request, request)
+    return await _drain(response, client_delay)
+
+
+async def _binary_child(args: argparse.Namespace) -> None:
+    """One mode in a fresh process, so ru_maxrss reflects only that mode."""
+    import resource
+
+    with StubImageServer(noise=True) as server:
+        app.generator.client = StubDalleClient(server.url, 0, rate=10 ** 6)
+        app.upstreams["azure_openai"].bucket = app.TokenBucket(rate=1e6, capacity=1e6)
+        await _serve_image(args.child, server.url, -1, 0)
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for round_ in range(max(1, args.requests // args.concurrency)):
+            await asyncio.gather(*(
+                _serve_image(args.child, server.url, round_ * args.concurrency + i, args.client_delay)
+                for i in range(args.concurrency)
+            ))
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"baseline_kb": baseline, "peak_kb": peak}))
+    app.image_pool.shutdown()
+
+
+async def bench_binary(args: argparse.Namespace) -> None:
+    """
+    Binary thumbnail responses: the old copy-then-stream path ("before") against
+    memoryview slices of the encoder's buffer ("after"). Per request: bytes copied
+    on the way out, body chunks, and tracemalloc's peak of Python allocations
+    (the encoded image and its copies; Pillow's pixel buffers are not traced).
+    Peak RSS comes from a fresh process per mode serving --concurrency requests at once.
+    """
+    import tracemalloc
+
+    if args.child:
+        return await _binary_child(args)
+
+    img = Image.merge("RGB", [Image.effect_noise((1280, 720), sigma) for sigma in (20, 30, 40)])
+    for progressive in (False, True):
+        output = io.BytesIO()
+        start = time.perf_counter()
+        img.save(output, format="JPEG", quality=95, progressive=progressive)
+        print(f"encode progressive={progressive!s:<5} {(time.perf_counter() - start) * 1000:6.1f}ms  {output.tell()} bytes")
+
+    with StubImageServer(noise=True) as server:
+        app.generator.client = StubDalleClient(server.url, 0, rate=10 ** 6)
+        app.upstreams["azure_openai"].bucket = app.TokenBucket(rate=1e6, capacity=1e6)
+        for mode in ("before", "after"):
+            await _serve_image(mode, server.url, -1, 0)
+            tracemalloc.start()
+            peaks, sent = [], {}
+            for i in range(args.requests):
+                tracemalloc.reset_peak()
+                current = tracemalloc.get_traced_memory()[0]
+                sent = await _serve_image(mode, server.url, i, 0)
+                peaks.append(tracemalloc.get_traced_memory()[1] - current)
+            tracemalloc.stop()
+            print(
+                f"{mode:<7} image={sent['bytes']} bytes  copied on send={sent['copied']}  chunks={sent['chunks']}  "
+                f"traced peak/request={statistics.median(peaks) / 1024:7.1f}KiB ({statistics.median(peaks) / sent['bytes']:.1f}x image)"
+            )
+    app.image_pool.shutdown()
+
+    for mode in ("before", "after"):
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "binary", "--child", mode,
+             "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+             "--client-delay", str(args.client_delay)],
+            capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise SystemExit(result.stderr[-2000:])
+        rss = json.loads(result.stdout.strip().splitlines()[-1])
+        print(
+            f"{mode:<7} {args.concurrency} concurrent responses to slow clients: peak RSS {rss['peak_kb'] / 1024:.1f}MiB "
+            f"(+{(rss['peak_kb'] - rss['baseline_kb']) / 1024:.1f}MiB over one request)"
+        )
+
+
+class FlakyUpstream:
+    """
+    Fake provider call that injects faults: 5xx errors, 429s and slow tail responses
+    with the given probabilities, on top of a base latency.
+    """
+
+    def __init__(self, latency: float, error_rate: float, throttle_rate: float, tail_rate: float, seed: int = 11):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.tail_rate = tail_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    async def __call__(self) -> Dict[str, Any]:
+        self.calls += 1
+        roll = self._random.random()
+        if roll < self.error_rate:
+            await asyncio.sleep(self.latency)
+            response = httpx.Response(503, request=httpx.Request("POST", "https://upstream.invalid/search"))
+            raise httpx.HTTPStatusError("Service unavailable", request=response.request, response=response)
+        if roll < self.error_rate + self.throttle_rate:
+            raise tavily.errors.UsageLimitExceededError("Rate limit exceeded")
+        tail = self._random.random() < self.tail_rate
+        await asyncio.sleep(self.latency * (10 if tail else 1) * self._random.uniform(0.8, 1.2))
+        return {"results": []}
+
+
+async def _drive(upstream: "app.Upstream", fake: FlakyUpstream, calls: int, concurrency: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async def one() -> None:
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await upstream.call("benchmark", fake)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return {"elapsed": time.perf_counter() - start, "latencies": latencies, "failures": failures}
+
+
+async def bench_resilience(args: argparse.Namespace) -> None:
+    def policy(**kwargs) -> "app.Upstream":
+        options = {"max_attempts": 3, "backoff_base": 0.05, "backoff_max": 0.5, "hedge": True}
+        options.update(kwargs)
+        breaker = app.CircuitBreaker(failure_threshold=options.pop("breaker_failures", 10**9), reset_timeout=30)
+        return app.Upstream("fake", bucket=app.TokenBucket(rate=1e6, capacity=1e6), timeout=5, breaker=breaker, **options)
+
+    print(f"flaky upstream: {args.error_rate:.0%} 5xx, {args.throttle_rate:.0%} 429, {args.tail_rate:.0%} slow (10x)")
+    for name, upstream in [
+        ("no policy", policy(max_attempts=1, hedge=False)),
+        ("retries", policy(hedge=False)),
+        ("retries+hedge", policy()),
+    ]:
+        fake = FlakyUpstream(args.latency, args.error_rate, args.throttle_rate, args.tail_rate)
+        result = await _drive(upstream, fake, args.calls, args.concurrency)
+        latencies = result["latencies"]
+        print(
+            f"{name:<14} ok={len(latencies) / args.calls:6.1%}  "
+            f"p50={statistics.median(latencies) * 1000:7.1f}ms  p99={_percentile(latencies, 99) * 1000:7.1f}ms  "
+            f"upstream calls={fake.calls:<5} hedges={upstream.counts['hedges']}"
+        )
+
+    print("outage (every call fails):")
+    for name, upstream in [
+        ("retries", policy(hedge=False)),
+        ("breaker", policy(hedge=False, breaker_failures=5)),
+    ]:
+        fake = FlakyUpstream(args.latency, 1.0, 0, 0)
+        result = await _drive(upstream, fake, args.calls, args.concurrency)
+        print(
+            f"{name:<14} {result['elapsed'] * 1000:8.1f}ms for {args.calls} failed calls  "
+            f"upstream calls={fake.calls:<5} rejected fast={upstream.counts['rejected']}"
+        )
+
+
+_MARKER_RE = re.compile(r"marker\d+x")
+
+
+class EchoTavilyClient:
+    """Tavily stand-in whose results are derived from the query/URL, with random latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def _sleep(self) -> None:
+        await asyncio.sleep(random.uniform(0, self.latency))
+
+    async def search(self, query: str, **kwargs) -> Dict[str, Any]:
+        await self._sleep()
+        return {"results": [{"url": f"https://{marker}.example/{i}/" for marker in _MARKER_RE.findall(query)}
+                            for i in range(3)]}
+
+    async def map(self, url: str, **kwargs) -> Dict[str, Any]:
+        await self._sleep()
+        return {"urls": [f"{url}page/{i}" for i in range(5)]}
+
+    async def crawl(self, url: str, **kwargs) -> Dict[str, Any]:
+        await self._sleep()
+        return {"content": f"An article about {' '.join(_MARKER_RE.findall(url))} with plenty of detail."}
+
+
+class EchoGeminiClient:
+    """Gemini stand-in that answers with whatever request markers appear in the prompt."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self._generate_content))
+
+    async def _generate_content(self, model: str, contents: str, config: Any = None) -> Any:
+        await asyncio.sleep(random.uniform(0, self.latency))
+        if "JSON array" in contents:
+            text = json.dumps(re.findall(r"https://\S+", contents)[:5])
+        else:
+            text = " ".join(sorted(set(_MARKER_RE.findall(contents))))
+        return SimpleNamespace(text=text)
+
+
+async def _global_prompt_pipeline(request: "app.GenerateRequest", shared: Dict[str, str]) -> str:
+    """The pipeline shape before PipelineContext: the query lives in a module-level global."""
+    shared["USER_PROMPT"] = request.query
+    search_query = await app.generate_search_query_from_user_input(shared["USER_PROMPT"], use_cache=False)
+    search_urls = await app.tavily_search(search_query, max_results=5, use_cache=False)
+    expanded = await app.tavily_sitemap(search_urls, use_cache=False)
+    filtered = await app.gemini_filter_urls_via_prompt(shared["USER_PROMPT"], expanded, use_cache=False)
+    crawled = await app.tavily_crawl(filtered, use_cache=False)
+    return await app.generate_content_with_gemini(shared["USER_PROMPT"], crawled, use_cache=False)
+
+
+async def bench_isolation(args: argparse.Namespace) -> None:
+    """
+    Stress test: many concurrent requests, each with a unique marker in its query.
+    Every marker found in a result must be the request's own; anything else is a leak.
+    """
+    app.tavily_client = EchoTavilyClient(args.latency)
+    app.gemini_client = EchoGeminiClient(args.latency)
+    for upstream in app.upstreams.values():
+        upstream.bucket = app.TokenBucket(rate=1e6, capacity=1e6)  # The stubs have no quota
+
+    async def global_prompt(request: "app.GenerateRequest") -> str:
+        return await _global_prompt_pipeline(request, shared)
+
+    async def context(request: "app.GenerateRequest") -> str:
+        return (await app.generate_content_endpoint(request))["result"]
+
+    shared: Dict[str, str] = {}
+    for name, run in [("global", global_prompt), ("context", context)]:
+        requests_ = [
+            app.GenerateRequest(query=f"tips for marker{i}x videos", use_cache=False) for i in range(args.requests)
+        ]
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run(request) for request in requests_))
+        elapsed = time.perf_counter() - start
+        leaked = 0
+        for i, result in enumerate(results):
+            if set(_MARKER_RE.findall(result)) != {f"marker{i}x"}:
+                leaked += 1
+        print(f"{name:<8} {len(results)} concurrent requests in {elapsed * 1000:7.1f}ms  contaminated={leaked}")
+        if name == "context" and leaked:
+            raise SystemExit("Cross-request contamination detected")
+
+
+# Groups of differently worded queries a creator might send for the same idea
+_PARAPHRASES = [
+    ["best budget mics 2026", "budget microphones 2026", "cheap microphones for youtubers", "affordable mic for youtube videos"],
+    ["how to grow a cooking channel", "growing a cooking channel", "tips to grow my cooking channel", "cooking channel growth tips"],
+    ["home workout without equipment", "no equipment home workouts", "home workouts with no equipment", "bodyweight workout at home"],
+    ["editing software for beginners", "beginner video editing software", "best video editing software for beginners", "video editor for beginners"],
+    ["lighting setup for small rooms", "small room lighting setup", "lighting a small room for video", "cheap lighting for small rooms"],
+]
+
+# Query pairs checked one by one: (first, second, whether the second may reuse the first's run).
+# A year only one query names is ignored when it is the current one
+_YEAR = time.localtime().tm_year
+_PAIRS = [
+    (f"best budget mics {_YEAR}", "cheap microphones for youtubers", True),
+    ("cooking channel growth", "cooking channel growth tips", True),
+    (f"mic reviews {_YEAR - 1}", f"mic reviews {_YEAR}", False),
+    ("gaming pc build", "budget gaming pc build", False),
+    ("python tutorial", "python tutorial for kids", False),
+    ("keto meal prep", "vegan meal prep", False),
+    ("is a standing desk worth it", "is a standing desk not worth it", False),
+]
+
+
+async def bench_semantic(args: argparse.Namespace) -> None:
+    """
+    Paraphrased queries through the content pipeline, with only the exact-key response
+    cache and then with the semantic cache as well; counts upstream calls per request.
+    Then checks which of `_PAIRS` the semantic cache would let reuse each other's run.
+    """
+    app.tavily_client = StubTavilyClient(args.latency)
+    app.gemini_client = StubGeminiClient(args.latency)
+    for upstream in app.upstreams.values():
+        upstream.bucket = app.TokenBucket(rate=1e6, capacity=1e6)
+    queries = [query for group in _PARAPHRASES for query in group]
+    random.Random(0).shuffle(queries)
+
+    for name, enabled in [("exact", False), ("semantic", True)]:
+        app.response_cache.backend = app.LRUCache()
+        cache = app.SemanticCache()
+        if not enabled:
+            cache.result_threshold = cache.reuse_threshold = 2.0  # Nothing is ever similar enough
+        app.semantic_cache = cache
+        calls_before = sum(upstream.counts["calls"] for upstream in app.upstreams.values())
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            await app.run_content_pipeline(app.PipelineContext(query, "social_post"))
+            latencies.append(time.perf_counter() - start)
+        calls = sum(upstream.counts["calls"] for upstream in app.upstreams.values()) - calls_before
+        stats = cache.stats()
+        print(
+            f"{name:<9} {len(queries)} queries  upstream calls={calls:4d} ({calls / len(queries):.1f}/request)  "
+            f"mean={statistics.mean(latencies) * 1000:6.1f}ms  "
+            f"hits: result={stats['result']} intermediates={stats['intermediates']} miss={stats['miss']} "
+            f"rate={stats['hit_rate']:.0%}"
+        )
+
+    cache = app.SemanticCache()
+    for first, second, expected in _PAIRS:
+        similarity = float(cache.embed(first) @ cache.embed(second))
+        reused = similarity >= cache.reuse_threshold and cache.compatible(cache.terms(first), cache.terms(second))
+        print(
+            f"{'ok  ' if reused == expected else 'MISS' if expected else 'BAD '} similarity={similarity:.3f} "
+            f"reused={reused!s:<5} {first!r} / {second!r}"
+        )
+
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+# Cold start: import the app, run the lifespan and answer one request, with no credentials set
+_COLD_START = """
+import time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.app) as client:
+    client.get("/health").raise_for_status()
+    responded = time.perf_counter()
+print(f"{(imported - started) * 1000:.1f} {(responded - started) * 1000:.1f}")
+"""
+
+
+async def bench_startup(args: argparse.Namespace) -> None:
+    """
+    Cold-start regression budget: `python -X importtime -c "import app"` in a fresh
+    interpreter without provider credentials. Exits non-zero when the median import
+    time exceeds --budget-ms.
+    """
+    backend = os.path.dirname(os.path.abspath(__file__))
+    env = {key: value for key, value in os.environ.items()
+           if key not in ("GEMINI_API_KEY", "GOOGLE_API_KEY", "TAVILY_API_KEY", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT")}
+    # Otherwise load_dotenv() restores the credentials from a developer's backend/.env
+    env["PYTHON_DOTENV_DISABLED"] = "1"
+    env["JOB_SQLITE_PATH"] = os.path.join(backend, ".cache", "benchmark-jobs.sqlite3")
+
+    imports, cold_starts = [], []
+    modules: Dict[str, List[float]] = collections.defaultdict(list)
+    for _ in range(args.runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app"],
+            cwd=backend, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise SystemExit(f"import app failed without credentials:\n{result.stderr[-2000:]}")
+        for match in _IMPORTTIME_RE.finditer(result.stderr):
+            _, cumulative, indent, name = match.groups()
+            if name == "app":
+                imports.append(int(cumulative) / 1000)
+            elif len(indent) == 3:  # Imported directly by app.py
+                modules[name].append(int(cumulative) / 1000)
+
+        result = subprocess.run(
+            [sys.executable, "-c", _COLD_START], cwd=backend, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise SystemExit(f"Cold start failed:\n{result.stderr[-2000:]}")
+        cold_starts.append(float(result.stdout.split()[-1]))
+
+    print(f"import app      p50={statistics.median(imports):8.1f}ms  min={min(imports):8.1f}ms  budget={args.budget_ms:.0f}ms")
+    print(f"first response  p50={statistics.median(cold_starts):8.1f}ms  min={min(cold_starts):8.1f}ms")
+    print("slowest direct imports:")
+    for name, samples in sorted(modules.items(), key=lambda item: -statistics.median(item[1]))[:args.top]:
+        print(f"  {name:<32} {statistics.median(samples):8.1f}ms")
+    if statistics.median(imports) > args.budget_ms:
+        raise SystemExit(f"Import time over budget: {statistics.median(imports):.1f}ms > {args.budget_ms:.0f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pipeline = subparsers.add_parser("pipeline", help="/generate-content latency with stubbed Tavily/Gemini")
+    pipeline.add_argument("--runs", type=int, default=20)
+    pipeline.add_argument("--latency", type=float, default=0.2, help="Seconds per stubbed upstream call")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    prompts = subparsers.add_parser("prompts", help="System prompt lookup overhead per request")
+    prompts.add_argument("--iterations", type=int, default=2000)
+    prompts.set_defaults(func=bench_prompts)
+
+    downloads = subparsers.add_parser("downloads", help="Image download throughput against a local stub server")
+    downloads.add_argument("--requests", type=int, default=200)
+    downloads.add_argument("--concurrency", type=int, default=20)
+    downloads.add_argument("--handshake-ms", type=float, default=30, help="Simulated setup cost per new connection")
+    downloads.set_defaults(func=bench_downloads)
+
+    imaging = subparsers.add_parser("imaging", help="Event loop lag while processing thumbnails")
+    imaging.add_argument("--images", type=int, default=16)
+    imaging.set_defaults(func=bench_imaging)
+
+    overlay = subparsers.add_parser("overlay", help="Text overlay cost across stroke widths and text lengths")
+    overlay.add_argument("--iterations", type=int, default=20)
+    overlay.set_defaults(func=bench_overlay)
+
+    fonts = subparsers.add_parser("fonts", help="Overlay font setup and auto-fit layout cost")
+    fonts.add_argument("--iterations", type=int, default=200)
+    fonts.set_defaults(func=bench_fonts)
+
+    renditions = subparsers.add_parser("renditions", help="Cascade rendition pipeline vs per-size processing")
+    renditions.add_argument("--runs", type=int, default=5)
+    renditions.set_defaults(func=bench_renditions)
+
+    stream = subparsers.add_parser("stream", help="Time to first byte for buffered vs SSE content generation")
+    stream.add_argument("--runs", type=int, default=5)
+    stream.add_argument("--latency", type=float, default=0.2, help="Seconds per stubbed upstream call")
+    stream.set_defaults(func=bench_stream)
+
+    prefilter = subparsers.add_parser("prefilter", help="Gemini URL filter prompt size and latency on large sitemaps")
+    prefilter.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    prefilter.add_argument("--latency", type=float, default=0.3, help="Base seconds per stubbed Gemini call")
+    prefilter.add_argument("--ms-per-1k-tokens", type=float, default=20, help="Stubbed prompt processing cost")
+    prefilter.set_defaults(func=bench_prefilter)
+
+    batch = subparsers.add_parser("batch", help="Batch thumbnail throughput and 429s against a quota-limited DALL-E stub")
+    batch.add_argument("--items", type=int, default=40)
+    batch.add_argument("--rate", type=int, default=10, help="Stubbed DALL-E quota in calls per second")
+    batch.add_argument("--concurrency", type=int, default=16)
+    batch.add_argument("--latency", type=float, default=0.2, help="Seconds per stubbed DALL-E call")
+    batch.set_defaults(func=bench_batch)
+
+    presets = subparsers.add_parser("presets", help="Preset thumbnails from the warm pool vs fresh DALL-E images")
+    presets.add_argument("--requests", type=int, default=24)
+    presets.add_argument("--latency", type=float, default=2.0, help="Seconds per stubbed DALL-E call")
+    presets.add_argument("--pool-size", type=int, default=2, help="Backgrounds per preset")
+    presets.set_defaults(func=bench_presets)
+
+    resilience = subparsers.add_parser("resilience", help="Retries, hedging and circuit breaking against a flaky fake upstream")
+    resilience.add_argument("--calls", type=int, default=300)
+    resilience.add_argument("--concurrency", type=int, default=10)
+    resilience.add_argument("--latency", type=float, default=0.05, help="Base seconds per fake upstream call")
+    resilience.add_argument("--error-rate", type=float, default=0.1, help="Share of calls failing with a 503")
+    resilience.add_argument("--throttle-rate", type=float, default=0.05, help="Share of calls answered with a 429")
+    resilience.add_argument("--tail-rate", type=float, default=0.05, help="Share of calls that are 10x slower")
+    resilience.set_defaults(func=bench_resilience)
+
+    binary = subparsers.add_parser("binary", help="Bytes copied and peak RSS of binary thumbnail responses, before/after")
+    binary.add_argument("--requests", type=int, default=20)
+    binary.add_argument("--concurrency", type=int, default=16)
+    binary.add_argument("--client-delay", type=float, default=0.002, help="Seconds a slow client takes per chunk")
+    binary.add_argument("--child", choices=["before", "after"], help=argparse.SUPPRESS)
+    binary.set_defaults(func=bench_binary)
+
+    isolation = subparsers.add_parser("isolation", help="Concurrency stress test for cross-request contamination")
+    isolation.add_argument("--requests", type=int, default=200)
+    isolation.add_argument("--latency", type=float, default=0.05, help="Max seconds per stubbed upstream call")
+    isolation.set_defaults(func=bench_isolation)
+
+    semantic = subparsers.add_parser("semantic", help="Paraphrased queries with and without the semantic cache")
+    semantic.add_argument("--latency", type=float, default=0.05, help="Max seconds per stubbed upstream call")
+    semantic.set_defaults(func=bench_semantic)
+
+    startup = subparsers.add_parser("startup", help="Cold-start import time against a regression budget")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--budget-ms", type=float, default=1500, help="Fail when the median import time exceeds this")
+    startup.add_argument("--top", type=int, default=10, help="How many of the slowest direct imports to list")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
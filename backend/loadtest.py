@@ -0,0 +1,485 @@
+"""
+End-to-end load test: runs the app under uvicorn against local fake Azure OpenAI,
+Gemini, Tavily and image-hosting servers, drives its endpoints at a fixed
+concurrency and reports throughput, latency percentiles and event loop lag.
+
+Usage (from the repository root):
+    python backend/loadtest.py run --scenarios thumbnail preset content --concurrency 16 --requests 200
+    python backend/loadtest.py run --dalle-latency 2 --error-rate 0.05 --output before.json
+    python backend/loadtest.py run --scenarios preset --preset-pool 2
+    python backend/loadtest.py compare before.json after.json
+
+Upstream latencies are log-normal around the given medians (spread set by
+--latency-sigma); --error-rate and --throttle-rate inject 503s and 429s into the
+DALL-E, Gemini and Tavily fakes. Results are saved as JSON, by default under
+backend/.cache/loadtest/, so runs can be compared between commits.
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import math
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+PRESETS = ["tech", "gaming", "educational", "lifestyle", "cooking", "fitness"]
+FORMATS = ["social_post", "youtube_script", "reel_script"]
+
+# Each scenario maps a request number to (method, path, httpx request kwargs)
+SCENARIOS: Dict[str, Callable[[str, int], Tuple[str, str, Dict[str, Any]]]] = {
+    "thumbnail": lambda run, i: ("POST", "/generate/thumbnail", {
+        "json": {"title": f"Load test video {run}-{i}", "overlay_text": f"Episode {i}"}
+    }),
+    "thumbnail_image": lambda run, i: ("POST", "/generate/thumbnail", {
+        "json": {"title": f"Load test video {run}-{i}", "overlay_text": f"Episode {i}"},
+        "headers": {"Accept": "image/jpeg"}
+    }),
+    "preset": lambda run, i: ("POST", "/generate/thumbnail/preset", {
+        "params": {"preset": PRESETS[i % len(PRESETS)], "title": f"Load test video {run}-{i}", "overlay_text": f"Part {i}"}
+    }),
+    "content": lambda run, i: ("POST", "/generate-content", {
+        "json": {"query": f"budget microphones for creators {run}-{i}", "format": FORMATS[i % len(FORMATS)], "use_cache": False}
+    }),
+}
+
+
+def build_fake_upstreams(args: argparse.Namespace):
+    """Starlette app that imitates the DALL-E, Gemini, Tavily and image host APIs the backend calls."""
+    from PIL import Image
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+
+    source = Image.merge("RGB", [Image.effect_noise((1792, 1024), 24).point(lambda v, k=k: (v + k) % 256)
+                                 for k in (40, 90, 160)])
+    buffer = io.BytesIO()
+    source.save(buffer, format="PNG" if args.image_format == "png" else "JPEG", quality=90)
+    image_body = buffer.getvalue()
+    image_type = "image/png" if args.image_format == "png" else "image/jpeg"
+    generated = itertools.count()
+
+    async def delay(median: float) -> None:
+        if median > 0:
+            await asyncio.sleep(random.lognormvariate(math.log(median), args.latency_sigma))
+
+    def fault(error_body: Callable[[int, str], Dict[str, Any]]) -> Optional[Response]:
+        roll = random.random()
+        if roll < args.error_rate:
+            return JSONResponse(error_body(503, "Service unavailable"), status_code=503)
+        if roll < args.error_rate + args.throttle_rate:
+            return JSONResponse(error_body(429, "Rate limit exceeded"), status_code=429, headers={"Retry-After": "1"})
+        return None
+
+    def openai_error(code: int, message: str) -> Dict[str, Any]:
+        return {"error": {"code": str(code), "message": message}}
+
+    def google_error(code: int, message: str) -> Dict[str, Any]:
+        return {"error": {"code": code, "message": message, "status": "UNAVAILABLE" if code == 503 else "RESOURCE_EXHAUSTED"}}
+
+    def tavily_error(code: int, message: str) -> Dict[str, Any]:
+        return {"detail": {"error": message}}
+
+    async def health(request: Request) -> Response:
+        return JSONResponse({"status": "ok"})
+
+    async def dalle(request: Request) -> Response:
+        body = await request.json()
+        await delay(args.dalle_latency)
+        failure = fault(openai_error)
+        if failure is not None:
+            return failure
+        url = f"{request.base_url}images/{next(generated)}.{args.image_format}"
+        return JSONResponse({"created": int(time.time()), "data": [{"url": url, "revised_prompt": body["prompt"][:200]}]})
+
+    async def image(request: Request) -> Response:
+        await delay(args.image_latency)
+        return Response(image_body, media_type=image_type)
+
+    def gemini_text(prompt: str) -> str:
+        if "JSON array" in prompt:
+            return json.dumps(re.findall(r"https?://\S+", prompt)[:5])
+        if "search query" in prompt:
+            return "budget microphones for youtubers review"
+        return "POST:\n" + " ".join(["A practical rundown of microphones that sound great on a budget."] * 20) + \
+            "\nSOURCE_URLS:\n- https://example.com/reviews/1"
+
+    def gemini_chunk(text: str, prompt: str) -> Dict[str, Any]:
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4,
+                              "totalTokenCount": (len(prompt) + len(text)) // 4},
+            "modelVersion": "gemini-2.5-flash"
+        }
+
+    async def gemini(request: Request) -> Response:
+        body = await request.json()
+        prompt = " ".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+        text = gemini_text(prompt)
+        if request.path_params["model"].endswith(":streamGenerateContent"):
+            failure = fault(google_error)
+            if failure is not None:
+                return failure
+
+            async def chunks():
+                words = text.split(" ")
+                step = max(1, len(words) // 10)
+                for start in range(0, len(words), step):
+                    await delay(args.llm_latency / 10)
+                    piece = " ".join(words[start:start + step]) + ("" if start + step >= len(words) else " ")
+                    yield f"data: {json.dumps(gemini_chunk(piece, prompt))}\r\n\r\n"
+
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+        await delay(args.llm_latency)
+        return fault(google_error) or JSONResponse(gemini_chunk(text, prompt))
+
+    async def tavily_search(request: Request) -> Response:
+        body = await request.json()
+        await delay(args.search_latency)
+        results = [{"url": f"https://site{i}.example.com/", "title": f"Result {i}", "content": body["query"], "score": 0.9}
+                   for i in range(body.get("max_results", 5))]
+        return fault(tavily_error) or JSONResponse({"query": body["query"], "results": results, "response_time": 0.1})
+
+    async def tavily_map(request: Request) -> Response:
+        body = await request.json()
+        await delay(args.search_latency)
+        base = body["url"].rstrip("/")
+        urls = [f"{base}/reviews/budget-microphone-{i}" for i in range(20)] + [f"{base}/tag/audio-{i}" for i in range(10)]
+        return fault(tavily_error) or JSONResponse({"base_url": body["url"], "results": urls, "response_time": 0.1})
+
+    async def tavily_crawl(request: Request) -> Response:
+        body = await request.json()
+        await delay(args.search_latency * 3)
+        page = "Budget microphones compared for clarity, noise and price. " * 80
+        results = [{"url": f"{body['url'].rstrip('/')}/page-{i}", "raw_content": page} for i in range(3)]
+        return fault(tavily_error) or JSONResponse({"base_url": body["url"], "results": results, "response_time": 0.3})
+
+    return Starlette(routes=[
+        Route("/healthz", health),
+        Route("/openai/deployments/{deployment}/images/generations", dalle, methods=["POST"]),
+        Route("/images/{name}", image),
+        Route("/v1beta/models/{model}", gemini, methods=["POST"]),
+        Route("/search", tavily_search, methods=["POST"]),
+        Route("/map", tavily_map, methods=["POST"]),
+        Route("/crawl", tavily_crawl, methods=["POST"]),
+    ])
+
+
+def serve_fakes(args: argparse.Namespace) -> None:
+    import uvicorn
+
+    uvicorn.run(build_fake_upstreams(args), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise SystemExit(f"{url} exited during startup with code {process.returncode}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"{url} did not become ready within {timeout:.0f}s")
+
+
+async def _wait_preset_pool(base: str, size: int, timeout: float = 300) -> None:
+    """Block until the app's preset pool holds `size` backgrounds for every preset."""
+    started = time.monotonic()
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() - started < timeout:
+            images = (await client.get(f"{base}/presets/pool")).json()["images"]
+            if min(images.values()) >= size:
+                print(f"preset pool filled in {time.monotonic() - started:.1f}s")
+                return
+            await asyncio.sleep(0.5)
+    raise SystemExit(f"preset pool did not fill within {timeout:.0f}s")
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+_SAMPLE_RE = re.compile(r'^(\w+?)(?:\{(.*)\})? (\S+)$')
+
+
+def _scrape(text: str) -> Dict[Tuple[str, str], float]:
+    """Parse Prometheus text into {(name, labels): value}."""
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE_RE.match(line)
+        if match:
+            samples[(match.group(1), match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+def _lag_summary(before: Dict[Tuple[str, str], float], after: Dict[Tuple[str, str], float]) -> Dict[str, Any]:
+    """Event loop lag over the scenario, from the delta of the app's lag histogram (bucket upper bounds)."""
+    name = "creatorcompass_event_loop_lag_seconds"
+    buckets = sorted(
+        (float(re.search(r'le="([^"]+)"', labels).group(1)), value - before.get((metric, labels), 0))
+        for (metric, labels), value in after.items() if metric == f"{name}_bucket"
+    )
+    count = after.get((f"{name}_count", ""), 0) - before.get((f"{name}_count", ""), 0)
+    total = after.get((f"{name}_sum", ""), 0) - before.get((f"{name}_sum", ""), 0)
+    if not count:
+        return {}
+
+    def quantile(q: float) -> float:
+        for bound, cumulative in buckets:
+            if cumulative >= q * count:
+                return bound * 1000
+        return math.inf
+
+    return {"samples": int(count), "mean_ms": round(total / count * 1000, 2),
+            "p50_ms_le": quantile(0.5), "p95_ms_le": quantile(0.95), "p99_ms_le": quantile(0.99)}
+
+
+def _stage_means(before: Dict[Tuple[str, str], float], after: Dict[Tuple[str, str], float]) -> Dict[str, float]:
+    """Mean server-side duration per stage over the scenario, in ms."""
+    name = "creatorcompass_stage_duration_seconds"
+    means = {}
+    for (metric, labels), value in after.items():
+        if metric == f"{name}_count":
+            count = value - before.get((metric, labels), 0)
+            if count:
+                total = after[(f"{name}_sum", labels)] - before.get((f"{name}_sum", labels), 0)
+                means[re.search(r'stage="([^"]+)"', labels).group(1)] = round(total / count * 1000, 1)
+    return dict(sorted(means.items()))
+
+
+async def drive(client: httpx.AsyncClient, base: str, scenario: str, run_id: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    numbers = iter(range(requests))
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+
+    async def worker() -> None:
+        for i in numbers:
+            method, path, kwargs = SCENARIOS[scenario](run_id, i)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, base + path, **kwargs)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            statuses[status] += 1
+            if status.startswith("2"):
+                latencies.append(time.perf_counter() - start)
+
+    before = _scrape((await client.get(f"{base}/metrics")).text)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    after = _scrape((await client.get(f"{base}/metrics")).text)
+
+    result: Dict[str, Any] = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2),
+        "statuses": dict(statuses),
+        "error_rate": round(1 - len(latencies) / requests, 4),
+        "event_loop_lag": _lag_summary(before, after),
+        "stage_mean_ms": _stage_means(before, after),
+    }
+    if latencies:
+        result.update({
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1),
+            "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        })
+    return result
+
+
+def _print_result(name: str, result: Dict[str, Any]) -> None:
+    lag = result["event_loop_lag"]
+    print(
+        f"{name:<16} rps={result['rps']:7.2f}  "
+        f"p50={result.get('p50_ms', math.nan):8.1f}ms  p95={result.get('p95_ms', math.nan):8.1f}ms  "
+        f"p99={result.get('p99_ms', math.nan):8.1f}ms  errors={result['error_rate']:6.1%}  "
+        f"loop lag p99<={lag.get('p99_ms_le', math.nan)}ms mean={lag.get('mean_ms', math.nan)}ms"
+    )
+    if set(result["statuses"]) - {"200"}:
+        print(f"{'':<16} statuses={result['statuses']}")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> None:
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    fake_port, app_port = _free_port(), _free_port()
+    fake_base, app_base = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+
+    fake_args = [
+        "--dalle-latency", str(args.dalle_latency), "--llm-latency", str(args.llm_latency),
+        "--search-latency", str(args.search_latency), "--image-latency", str(args.image_latency),
+        "--latency-sigma", str(args.latency_sigma), "--error-rate", str(args.error_rate),
+        "--throttle-rate", str(args.throttle_rate), "--image-format", args.image_format,
+    ]
+    app_env = {
+        **os.environ,
+        "AZURE_OPENAI_ENDPOINT": fake_base,
+        "AZURE_OPENAI_API_KEY": "loadtest",
+        "GEMINI_API_KEY": "loadtest",
+        "GOOGLE_GEMINI_BASE_URL": fake_base,
+        "TAVILY_API_KEY": "tvly-loadtest",
+        "TAVILY_API_BASE_URL": fake_base,
+        "GEMINI_CONTEXT_CACHE": "0",
+        # The fakes have no quota; client-side limits would only measure themselves
+        "UPSTREAM_RATE_PER_MINUTE": "100000000",
+        "UPSTREAM_BURST": "100000",
+        "JOB_SQLITE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "THUMBNAIL_STORE_DIR": os.path.join(workdir, "thumbnails"),
+        "CACHE_BACKEND": "memory",
+    }
+    if args.preset_pool:
+        app_env.update(PRESET_POOL_SIZE=str(args.preset_pool), PRESET_POOL_INTERVAL="0.2",
+                       PRESET_POOL_DIR=os.path.join(workdir, "preset_pool"))
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        app_env[key] = value
+
+    processes = []
+    try:
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve-fakes", "--port", str(fake_port), *fake_args]
+        ))
+        await _wait_ready(f"{fake_base}/healthz", processes[-1])
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(app_port),
+             "--log-level", "warning", "--no-access-log"],
+            cwd=BACKEND_DIR, env=app_env
+        ))
+        await _wait_ready(f"{app_base}/health", processes[-1])
+        if args.preset_pool:
+            await _wait_preset_pool(app_base, args.preset_pool)
+
+        results: Dict[str, Any] = {}
+        limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            run_id = datetime.now().strftime("%H%M%S")
+            for scenario in args.scenarios:
+                if args.warmup:
+                    await drive(client, app_base, scenario, f"{run_id}w", args.warmup, min(args.warmup, args.concurrency))
+                results[scenario] = await drive(client, app_base, scenario, run_id, args.requests, args.concurrency)
+                _print_result(scenario, results[scenario])
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key != "func"},
+        "scenarios": results,
+    }
+    output = args.output or os.path.join(
+        BACKEND_DIR, ".cache", "loadtest", f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit'] or 'nogit'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"results saved to {output}")
+
+
+def compare(args: argparse.Namespace) -> None:
+    """Print the change in each scenario's headline numbers between two saved runs."""
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    for scenario in after["scenarios"]:
+        if scenario not in before["scenarios"]:
+            continue
+        old, new = before["scenarios"][scenario], after["scenarios"][scenario]
+        changes = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms", "error_rate"):
+            if key in old and key in new:
+                delta = (new[key] - old[key]) / old[key] if old[key] else math.inf if new[key] else 0
+                changes.append(f"{key}={old[key]}->{new[key]} ({delta:+.0%})")
+        print(f"{scenario:<10} " + "  ".join(changes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_upstream_options(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument("--dalle-latency", type=float, default=2.0, help="Median seconds per DALL-E call")
+        subparser.add_argument("--llm-latency", type=float, default=0.5, help="Median seconds per Gemini call")
+        subparser.add_argument("--search-latency", type=float, default=0.3, help="Median seconds per Tavily search/map call")
+        subparser.add_argument("--image-latency", type=float, default=0.1, help="Median seconds per image download")
+        subparser.add_argument("--latency-sigma", type=float, default=0.3, help="Log-normal spread of upstream latency")
+        subparser.add_argument("--error-rate", type=float, default=0.0, help="Share of upstream calls answered with a 503")
+        subparser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of upstream calls answered with a 429")
+        subparser.add_argument("--image-format", choices=["png", "jpeg"], default="png", help="What the fake image host serves")
+
+    run_parser = subparsers.add_parser("run", help="Start the fakes and the app, drive the scenarios, save JSON results")
+    run_parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--requests", type=int, default=100, help="Measured requests per scenario")
+    run_parser.add_argument("--warmup", type=int, default=4, help="Unmeasured requests per scenario")
+    run_parser.add_argument("--timeout", type=float, default=120, help="Client timeout per request in seconds")
+    run_parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                            help="Extra environment for the app, e.g. IMAGE_WORKERS=8")
+    run_parser.add_argument("--preset-pool", type=int, default=0, metavar="N",
+                            help="Enable the preset background pool with N images per preset and wait for it to fill")
+    run_parser.add_argument("--output", help="Where to write the JSON results")
+    add_upstream_options(run_parser)
+    run_parser.set_defaults(func=lambda args: asyncio.run(run(args)))
+
+    fakes = subparsers.add_parser("serve-fakes", help="Serve only the fake upstreams (used by `run`)")
+    fakes.add_argument("--port", type=int, default=8900)
+    add_upstream_options(fakes)
+    fakes.set_defaults(func=serve_fakes)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two saved result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()